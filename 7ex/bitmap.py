@@ -0,0 +1,128 @@
+import struct
+import zlib
+from index import SnapshotIndex
+from storage import DataType
+
+BITMAP_HEADER = struct.Struct('<BHI')
+INT_KEY = struct.Struct('<Q')
+
+KEY_NULL = 0
+KEY_INT = 1
+KEY_STR = 2
+
+def bitmap_rows(bitmap):
+    # номера установленных битов по возрастанию
+    row_indices = []
+    for byte_index, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')):
+        while byte:
+            low_bit = byte & -byte
+            row_indices.append(byte_index * 8 + low_bit.bit_length() - 1)
+            byte ^= low_bit
+    return row_indices
+
+def bitmap_count(bitmap):
+    return bin(bitmap).count('1')
+
+def _set_bits(bitmap, set_rows, clear_rows):
+    size = (max([bitmap.bit_length()] + [row_index + 1 for row_index in set_rows]) + 7) // 8
+    bits = bytearray(bitmap.to_bytes(size, 'little'))
+    for row_index in set_rows:
+        bits[row_index >> 3] |= 1 << (row_index & 7)
+    for row_index in clear_rows:
+        if row_index >> 3 < size:
+            bits[row_index >> 3] &= ~(1 << (row_index & 7)) & 0xFF
+    return int.from_bytes(bits, 'little')
+
+class BitmapIndex(SnapshotIndex):
+    MAGIC = b'BMAP'
+    DATA_TYPES = (DataType.INT, DataType.VARCHAR)
+
+    def _clear(self):
+        # значение -> битовая карта строк; изменения копятся и применяются пачкой,
+        # чтобы не пересоздавать большое число на каждую строку
+        self.bitmaps = {}
+        self.added = {}
+        self.removed = {}
+
+    def _key(self, value):
+        return value or None
+
+    def add_entry(self, value, row_index):
+        self.added.setdefault(self._key(value), []).append(row_index)
+        self.dirty = True
+
+    def add_entries(self, values, start_row_index):
+        for row_index, value in enumerate(values, start_row_index):
+            self.added.setdefault(self._key(value), []).append(row_index)
+        self.dirty = True
+
+    def remove_entry(self, value, row_index):
+        self.removed.setdefault(self._key(value), []).append(row_index)
+        self.dirty = True
+
+    def _apply(self):
+        for key in set(self.added) | set(self.removed):
+            bitmap = _set_bits(self.bitmaps.get(key, 0), self.added.get(key, []), self.removed.get(key, []))
+            if bitmap:
+                self.bitmaps[key] = bitmap
+            else:
+                self.bitmaps.pop(key, None)
+        self.added = {}
+        self.removed = {}
+
+    def find_bitmap(self, value):
+        if self.added or self.removed:
+            self._apply()
+        return self.bitmaps.get(self._key(value), 0)
+
+    def find_rows(self, value):
+        return bitmap_rows(self.find_bitmap(value))
+
+    def count_rows(self, value):
+        return bitmap_count(self.find_bitmap(value))
+
+    def covered_columns(self):
+        return [self.column_name]
+
+    def find_covered(self, value):
+        return [[value or None] for _ in self.find_rows(value)]
+
+    def _add_rows(self, rows):
+        for row_index, row in rows:
+            self.added.setdefault(self._key(row[0]), []).append(row_index)
+
+    def _dump(self):
+        self._apply()
+
+        chunks = []
+        for key, bitmap in self.bitmaps.items():
+            if key is None:
+                tag, encoded = KEY_NULL, b''
+            elif isinstance(key, int):
+                tag, encoded = KEY_INT, INT_KEY.pack(key)
+            else:
+                tag, encoded = KEY_STR, key.encode('utf-8')
+
+            # разреженные карты из нулевых байтов хорошо сжимаются
+            data = zlib.compress(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little'))
+            chunks.append(BITMAP_HEADER.pack(tag, len(encoded), len(data)))
+            chunks.append(encoded)
+            chunks.append(data)
+        return len(self.bitmaps), chunks
+
+    def _restore(self, data, pos, key_count):
+        for _ in range(key_count):
+            tag, key_size, data_size = BITMAP_HEADER.unpack_from(data, pos)
+            pos += BITMAP_HEADER.size
+            encoded = data[pos:pos + key_size]
+            pos += key_size
+
+            if tag == KEY_NULL:
+                key = None
+            elif tag == KEY_INT:
+                key = INT_KEY.unpack(encoded)[0]
+            else:
+                key = encoded.decode('utf-8')
+
+            self.bitmaps[key] = int.from_bytes(zlib.decompress(data[pos:pos + data_size]), 'little')
+            pos += data_size
@@ -0,0 +1,281 @@
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from storage import DataType
+from index import BaseIndex
+
+BTREE_PAGE_SIZE = 4096
+BTREE_MAGIC = b'BTRE'
+META_HEADER = struct.Struct('<4sQQQ')
+NODE_HEADER = struct.Struct('<BHQ')
+
+# запись листа - пара (ключ, номер строки), во внутреннем узле к ней добавляется ссылка на потомка
+LEAF_CAPACITY = (BTREE_PAGE_SIZE - NODE_HEADER.size) // 16
+INTERNAL_CAPACITY = (BTREE_PAGE_SIZE - NODE_HEADER.size - 8) // 24
+
+NO_PAGE = 0
+
+class BTreeNode:
+    def __init__(self, is_leaf, keys=None, children=None, next_leaf=NO_PAGE):
+        self.is_leaf = is_leaf
+        self.keys = keys if keys is not None else []
+        self.children = children if children is not None else []
+        self.next_leaf = next_leaf
+
+    def to_bytes(self):
+        values = array('Q')
+        if not self.is_leaf:
+            values.extend(self.children)
+        for key, row_index in self.keys:
+            values.append(key)
+            values.append(row_index)
+
+        data = NODE_HEADER.pack(self.is_leaf, len(self.keys), self.next_leaf) + values.tobytes()
+        return data.ljust(BTREE_PAGE_SIZE, b'\x00')
+
+    @classmethod
+    def from_bytes(cls, data):
+        is_leaf, count, next_leaf = NODE_HEADER.unpack_from(data)
+        child_count = 0 if is_leaf else count + 1
+
+        values = array('Q')
+        values.frombytes(data[NODE_HEADER.size:NODE_HEADER.size + (child_count + 2 * count) * 8])
+
+        children = list(values[:child_count])
+        keys = list(zip(values[child_count::2], values[child_count + 1::2]))
+        return cls(bool(is_leaf), keys, children, next_leaf)
+
+class BTreeIndex(BaseIndex):
+    # файл - страницы узлов со своим заголовком, поэтому save и load свои
+    MAGIC = BTREE_MAGIC
+    DATA_TYPES = (DataType.INT,)
+
+    def __init__(self, index_file, column_name, unique=False):
+        self._file = None
+        super().__init__(index_file, column_name, unique)
+
+    def _clear(self):
+        self.nodes = {1: BTreeNode(True)}
+        self.dirty_pages = {1}
+        self.root = 1
+        self.page_count = 2
+
+    def _node(self, page_no):
+        node = self.nodes.get(page_no)
+        if node is None:
+            self._file.seek(page_no * BTREE_PAGE_SIZE)
+            node = BTreeNode.from_bytes(self._file.read(BTREE_PAGE_SIZE))
+            self.nodes[page_no] = node
+        return node
+
+    def _allocate(self, node):
+        page_no = self.page_count
+        self.page_count += 1
+        self.nodes[page_no] = node
+        self.dirty_pages.add(page_no)
+        return page_no
+
+    def _insert(self, page_no, entry):
+        node = self._node(page_no)
+        self.dirty_pages.add(page_no)
+
+        if node.is_leaf:
+            insort(node.keys, entry)
+            if len(node.keys) <= LEAF_CAPACITY:
+                return None
+
+            mid = len(node.keys) // 2
+            sibling = BTreeNode(True, node.keys[mid:], next_leaf=node.next_leaf)
+            node.keys = node.keys[:mid]
+            node.next_leaf = self._allocate(sibling)
+            return sibling.keys[0], node.next_leaf
+
+        pos = bisect_right(node.keys, entry)
+        split = self._insert(node.children[pos], entry)
+        if split is None:
+            return None
+
+        separator, new_page = split
+        node.keys.insert(pos, separator)
+        node.children.insert(pos + 1, new_page)
+        if len(node.keys) <= INTERNAL_CAPACITY:
+            return None
+
+        mid = len(node.keys) // 2
+        separator = node.keys[mid]
+        sibling = BTreeNode(False, node.keys[mid + 1:], node.children[mid + 1:])
+        node.keys = node.keys[:mid]
+        node.children = node.children[:mid + 1]
+        return separator, self._allocate(sibling)
+
+    def add_entry(self, value, row_index):
+        split = self._insert(self.root, (value or 0, row_index))
+        if split is not None:
+            separator, new_page = split
+            self.root = self._allocate(BTreeNode(False, [separator], [self.root, new_page]))
+        self.dirty = True
+
+    def remove_entry(self, value, row_index):
+        entry = (value or 0, row_index)
+        page_no = self.root
+        node = self._node(page_no)
+        while not node.is_leaf:
+            page_no = node.children[bisect_right(node.keys, entry)]
+            node = self._node(page_no)
+
+        pos = bisect_left(node.keys, entry)
+        if pos < len(node.keys) and node.keys[pos] == entry:
+            # узлы не сливаются: пустые листья просто пропускаются при сканировании
+            del node.keys[pos]
+            self.dirty_pages.add(page_no)
+            self.dirty = True
+
+    def _range_slices(self, low, high, low_inclusive, high_inclusive):
+        # части листьев (ключи, начало, конец), попадающие в диапазон, по порядку
+        # ключ 0 хранит NULL и не попадает ни в какой диапазон
+        if low is None or low < 1 or (low == 1 and not low_inclusive):
+            low, low_inclusive = 1, True
+
+        probe = (low, -1) if low_inclusive else (low, 2 ** 64)
+        stop = None
+        if high is not None:
+            stop = (high, 2 ** 64) if high_inclusive else (high, -1)
+
+        node = self._node(self.root)
+        while not node.is_leaf:
+            node = self._node(node.children[bisect_right(node.keys, probe)])
+
+        pos = bisect_left(node.keys, probe)
+        while True:
+            keys = node.keys
+            if stop is not None and keys and keys[-1] >= stop:
+                yield keys, pos, max(pos, bisect_left(keys, stop, pos))
+                return
+            yield keys, pos, len(keys)
+
+            if node.next_leaf == NO_PAGE:
+                return
+            node = self._node(node.next_leaf)
+            pos = 0
+
+    def find_range(self, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        row_indices = []
+        for keys, start, end in self._range_slices(low, high, low_inclusive, high_inclusive):
+            row_indices.extend(row_index for _, row_index in keys[start:end])
+        return row_indices
+
+    def count_range(self, low=None, high=None, low_inclusive=True, high_inclusive=True, limit=None):
+        # по длинам листьев, без списка строк; после limit счет прекращается
+        count = 0
+        for _, start, end in self._range_slices(low, high, low_inclusive, high_inclusive):
+            count += end - start
+            if limit is not None and count > limit:
+                break
+        return count
+
+    def find_rows(self, value):
+        if not value:
+            return []
+        return self.find_range(value, value)
+
+    def count_rows(self, value):
+        if not value:
+            return 0
+        return self.count_range(value, value)
+
+    def covered_columns(self):
+        return [self.column_name]
+
+    def find_covered(self, value):
+        return [[value] for _ in self.find_rows(value)]
+
+    def _bulk_load(self, entries):
+        self.nodes = {}
+        self.dirty_pages = set()
+        self.page_count = 1
+
+        leaves = []
+        for start in range(0, len(entries), LEAF_CAPACITY):
+            chunk = entries[start:start + LEAF_CAPACITY]
+            leaves.append((chunk[0], self._allocate(BTreeNode(True, chunk))))
+
+        if not leaves:
+            leaves.append(((0, 0), self._allocate(BTreeNode(True))))
+
+        for (_, page_no), (_, next_page) in zip(leaves, leaves[1:]):
+            self.nodes[page_no].next_leaf = next_page
+
+        level = leaves
+        while len(level) > 1:
+            parents = []
+            for start in range(0, len(level), INTERNAL_CAPACITY + 1):
+                group = level[start:start + INTERNAL_CAPACITY + 1]
+                node = BTreeNode(False, [key for key, _ in group[1:]], [page_no for _, page_no in group])
+                parents.append((group[0][0], self._allocate(node)))
+            level = parents
+
+        self.root = level[0][1]
+
+    def rebuild_index(self, storage, start_row_index=0):
+        if start_row_index:
+            super().rebuild_index(storage, start_row_index)
+            return
+
+        col_index = self._column_index(storage)
+        if col_index is None:
+            return
+
+        # дерево целиком строится снизу вверх из отсортированных пар
+        rows = storage.iter_rows(with_ids=True, columns=[col_index])
+        self._bulk_load(sorted((row[0] or 0, row_index) for row_index, row in rows))
+        self.loaded = True
+        self.dirty = True
+
+    def save(self, storage):
+        if self._file is None or not os.path.exists(self.index_file):
+            self.close()
+            self._file = open(self.index_file, 'w+b')
+            # новый файл - записываем все узлы, а не только измененные
+            self.dirty_pages = set(self.nodes)
+
+        for page_no in sorted(self.dirty_pages):
+            self._file.seek(page_no * BTREE_PAGE_SIZE)
+            self._file.write(self.nodes[page_no].to_bytes())
+
+        self._file.seek(0)
+        meta = META_HEADER.pack(BTREE_MAGIC, self.root, self.page_count, storage.get_row_count())
+        self._file.write(meta.ljust(BTREE_PAGE_SIZE, b'\x00'))
+        self._file.flush()
+
+        self.dirty_pages = set()
+        self.dirty = False
+
+    def load(self, storage):
+        self.loaded = True
+
+        if not os.path.exists(self.index_file):
+            self.rebuild_index(storage)
+            return
+
+        self.close()
+        self._file = open(self.index_file, 'r+b')
+        magic, root, page_count, row_count = META_HEADER.unpack_from(self._file.read(META_HEADER.size))
+        if self._is_outdated(magic, row_count, storage):
+            self.close()
+            self.rebuild_index(storage)
+            return
+
+        self.nodes = {}
+        self.dirty_pages = set()
+        self.root = root
+        self.page_count = page_count
+        self.dirty = False
+
+        if row_count < storage.get_row_count():
+            self.rebuild_index(storage, row_count)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
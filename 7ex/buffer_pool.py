@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+PAGE_SIZE = 8 * 1024
+DEFAULT_MEMORY_BUDGET = 8 * 1024 * 1024
+
+class BufferPool:
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.pages = OrderedDict()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_page(self, file_key, page_no, loader):
+        key = (file_key, page_no)
+        page = self.pages.get(key)
+
+        if page is not None:
+            self.pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+        self.misses += 1
+        page = loader(page_no)
+        self.pages[key] = page
+        self.used_bytes += len(page)
+
+        while self.used_bytes > self.memory_budget and len(self.pages) > 1:
+            _, evicted = self.pages.popitem(last=False)
+            self.used_bytes -= len(evicted)
+            self.evictions += 1
+
+        return page
+
+    def invalidate(self, file_key, page_no=None):
+        if page_no is not None:
+            page = self.pages.pop((file_key, page_no), None)
+            if page is not None:
+                self.used_bytes -= len(page)
+            return
+
+        for key in [key for key in self.pages if key[0] == file_key]:
+            self.used_bytes -= len(self.pages.pop(key))
+
+    def clear(self):
+        self.pages.clear()
+        self.used_bytes = 0
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'pages': len(self.pages),
+            'used_bytes': self.used_bytes,
+            'hit_ratio': self.hits / requests if requests else 0.0
+        }
@@ -1,246 +1,1068 @@
 import os
 import re
-from storage import TableSchema, Column, DataType, BinaryStorage
-from index import NumberIndex
+import json
+import operator
+import weakref
+from storage import TableSchema, Column, DataType, BinaryStorage, ColumnarStorage, StorageType, SyncPolicy
+from index import NumberIndex, StringHashIndex, CompactNumberIndex, SortedStringIndex, CompositeIndex, mark_stale
+from btree import BTreeIndex
+from fulltext import FullTextIndex, tokenize, match_terms
+from bitmap import BitmapIndex, bitmap_rows, bitmap_count
+from buffer_pool import BufferPool, DEFAULT_MEMORY_BUDGET
+from executor import scan, fetch, filter_rows, project, limit
+from sql_parser import parse_sql, bind_params, bind_value, Param, And, Or, Not, CreateTable, CreateIndex, Insert, Select, Delete, Vacuum
+
+INDEX_TYPES = {
+    'number': NumberIndex,
+    'btree': BTreeIndex,
+    'hash': StringHashIndex,
+    'compact': CompactNumberIndex,
+    'prefix': SortedStringIndex,
+    'fulltext': FullTextIndex,
+    'bitmap': BitmapIndex,
+    'composite': CompositeIndex
+}
+
+DEFAULT_INDEX_TYPES = {
+    DataType.INT: 'number',
+    DataType.VARCHAR: 'hash'
+}
+
+COMPARISON_OPERATORS = {
+    '=': operator.eq,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<>': operator.ne
+}
+
+RANGE_OPERATORS = ('<', '<=', '>', '>=', 'BETWEEN')
+
+# выборка строки по номеру дороже, чем декодирование очередной строки при последовательном чтении
+RANDOM_FETCH_COST = 4
+
+def _save_indexes(tables, indexes, catalog):
+    for index_key, index in indexes.items():
+        if index.loaded and index.dirty:
+            index.save(tables[catalog['indexes'][index_key]['table']])
+
+def _flush_all(tables, indexes, catalog):
+    # не ссылается на SimpleDB, поэтому годится для weakref.finalize
+    for storage in tables.values():
+        storage.flush()
+    _save_indexes(tables, indexes, catalog)
+
+class QueryPlan:
+    # все, что в SELECT и DELETE не зависит от значений: позиции столбцов, дерево условий
+    # со слотами Param, покрывающий индекс и индексы, которые нашел планировщик
+    def __init__(self, table_name, storage, col_indices, expression, index_keys, catalog_version):
+        self.table_name = table_name
+        self.storage = storage
+        self.col_indices = col_indices
+        self.expression = expression
+        self.index_keys = index_keys
+        self.catalog_version = catalog_version
+        self.scan_indices = col_indices
+        self.positions = {}
+        self.scan_names = []
+        self.covering = None
+        self.first_match_only = False
+        self.candidates = {}
+
+class PreparedStatement:
+    def __init__(self, db, statement):
+        self.db = db
+        self.statement = statement
+        self.storage = None
+        self.templates = None
+        self.plan = None
+
+    def _resolve_insert(self):
+        # таблица и преобразователи значений определяются один раз, пока таблицу не пересоздали
+        storage = self.db.tables[self.statement.table_name]
+        if storage is self.storage:
+            return
+
+        columns = storage.schema.columns
+        self.templates = []
+        for values in self.statement.rows:
+            if len(values) > len(columns):
+                raise Exception(f"Слишком много значений для таблицы {self.statement.table_name}")
+            self.templates.append([(col, value) for col, value in zip(columns, values)])
+        self.storage = storage
+
+    def _insert_rows(self, params_seq):
+        self.db._load_table(self.statement.table_name)
+        self._resolve_insert()
+
+        stored_value = self.db._stored_value
+        rows = []
+        for params in params_seq:
+            self._check_params(params)
+            for template in self.templates:
+                rows.append([stored_value(col, params[value.index] if isinstance(value, Param) else value)
+                             for col, value in template])
+
+        # значения уже приведены к типам столбцов по шаблонам
+        self.db._append_rows(self.statement.table_name, self.storage, rows)
+        return rows
+
+    def _resolve_query(self):
+        # план пересобирается, если таблицу пересоздали или изменился набор индексов
+        table_name = self.statement.table_name
+        self.db._load_table(table_name)
+        storage = self.db.tables[table_name]
+        plan = self.plan
+        if plan is not None and plan.storage is storage and plan.catalog_version == self.db.catalog_version:
+            return plan
+
+        columns = self.statement.columns if isinstance(self.statement, Select) else None
+        self.plan = self.db._query_plan(table_name, storage, columns, self.statement.where)
+        return self.plan
+
+    def _select_rows(self, params):
+        plan = self._resolve_query()
+        statement = self.statement
+        row_limit, offset = self.db._limit_offset(bind_value(statement.limit, params),
+                                                  bind_value(statement.offset, params))
+        expression = self.db._bind_expression(plan.expression, params, plan.storage)
+        return self.db._run_select(plan, expression, row_limit, offset)
+
+    def _check_params(self, params):
+        param_count = self.statement.param_count
+        if len(params) != param_count:
+            raise Exception(f"Ожидалось параметров: {param_count}, передано: {len(params)}")
+
+    def execute(self, params=()):
+        if isinstance(self.statement, Insert):
+            rows = self._insert_rows([params])
+            return "Строка добавлена" if len(rows) == 1 else f"Добавлено строк: {len(rows)}"
+
+        self._check_params(params)
+        if isinstance(self.statement, Select):
+            return list(self._select_rows(params))
+        if isinstance(self.statement, Delete) and not self.statement.all_rows:
+            plan = self._resolve_query()
+            return self.db._delete_where(plan, self.db._bind_expression(plan.expression, params, plan.storage))
+        return self.db._execute(bind_params(self.statement, params))
+
+    def execute_iter(self, params=()):
+        if not isinstance(self.statement, Select):
+            raise Exception("Построчно выполняется только SELECT")
+        self._check_params(params)
+        return self._select_rows(params)
+
+    def executemany(self, params_seq):
+        # все строки пакета вставляются одной операцией: одна запись в файл и одно обновление индексов
+        if isinstance(self.statement, Insert):
+            rows = self._insert_rows(params_seq)
+            return f"Добавлено строк: {len(rows)}"
+        return [self.execute(params) for params in params_seq]
 
 class SimpleDB:
-    def __init__(self, db_path="db_files"):
+    def __init__(self, db_path="db_files", vacuum_threshold=0.5, sync_policy=None, vectorized_scans=True,
+                 buffer_pool_size=DEFAULT_MEMORY_BUDGET):
         self.db_path = db_path
+        self.vacuum_threshold = vacuum_threshold
+        self.sync_policy = sync_policy or SyncPolicy()
+        self.vectorized_scans = vectorized_scans
+        self.buffer_pool = BufferPool(buffer_pool_size) if buffer_pool_size else None
         if not os.path.exists(db_path):
             os.makedirs(db_path)
         self.tables = {}
         self.indexes = {}
+        self.catalog_file = os.path.join(db_path, "catalog.json")
+        self.catalog = self._read_catalog()
+        # меняется при каждой записи каталога, по ней подготовленные запросы узнают о новых индексах
+        self.catalog_version = 0
+        # если close() не вызвали, буферы и индексы сохраняются при сборке объекта или выходе
+        self._finalizer = weakref.finalize(self, _flush_all, self.tables, self.indexes, self.catalog)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def flush(self):
+        _flush_all(self.tables, self.indexes, self.catalog)
+
+    def close(self):
+        self._finalizer.detach()
+        self._save_indexes()
+        for index in self.indexes.values():
+            index.close()
+        for storage in self.tables.values():
+            storage.close()
+
+    def _read_catalog(self):
+        if not os.path.exists(self.catalog_file):
+            return {'indexes': {}}
+
+        with open(self.catalog_file, 'r') as f:
+            return json.load(f)
+
+    def _write_catalog(self):
+        self.catalog_version += 1
+        with open(self.catalog_file, 'w') as f:
+            json.dump(self.catalog, f)
+
+    def _save_indexes(self):
+        _save_indexes(self.tables, self.indexes, self.catalog)
+
+    def _get_index(self, table_name, *col_names):
+        index = self.indexes.get("_".join((table_name,) + col_names))
+        if index is not None and not index.loaded:
+            index.load(self.tables[table_name])
+        return index
+
+    def _index_columns(self, entry):
+        # старые записи каталога хранят один столбец
+        return entry.get('columns') or [entry['column']]
+
+    def _table_index_keys(self, table_name):
+        return [(index_key, self._index_columns(entry)) for index_key, entry in self.catalog['indexes'].items()
+                if entry['table'] == table_name]
+
+    def _table_indexes(self, table_name, storage):
+        col_positions = {col.name: i for i, col in enumerate(storage.schema.columns)}
+
+        indexes = []
+        for _, columns in self._table_index_keys(table_name):
+            index = self._get_index(table_name, *columns)
+            if index is not None:
+                if index.MULTI_COLUMN:
+                    columns = columns + index.include_names
+                indexes.append((index, [col_positions[name] for name in columns]))
+        return indexes
+
+    def _index_value(self, index, row, positions):
+        values = [row[pos] if pos < len(row) else None for pos in positions]
+        return values if index.MULTI_COLUMN else values[0]
 
     def execute_sql(self, sql):
-        sql = sql.strip()
-
-        if sql.upper().startswith("CREATE TABLE"):
-            return self._create_table(sql)
-        elif sql.upper().startswith("SELECT"):
-            return self._select(sql)
-        elif sql.upper().startswith("INSERT"):
-            return self._insert(sql)
-        elif sql.upper().startswith("DELETE"):
-            return self._delete(sql)
-        elif sql.upper().startswith("CREATE INDEX"):
-            return self._create_index(sql)
+        statement = parse_sql(sql.strip())
+        if statement.param_count:
+            raise Exception("Запрос с параметрами ? выполняется через prepare")
+        return self._execute(statement)
+
+    def prepare(self, sql):
+        return PreparedStatement(self, parse_sql(sql.strip()))
+
+    def execute_iter(self, sql):
+        # строки SELECT по одной, без построения списка результата
+        statement = parse_sql(sql.strip())
+        if not isinstance(statement, Select):
+            raise Exception("Построчно выполняется только SELECT")
+        if statement.param_count:
+            raise Exception("Запрос с параметрами ? выполняется через prepare")
+        return self._select_rows(statement)
+
+    def _execute(self, statement):
+        if isinstance(statement, CreateTable):
+            return self._create_table(statement)
+        elif isinstance(statement, Select):
+            return self._select(statement)
+        elif isinstance(statement, Insert):
+            return self._insert(statement)
+        elif isinstance(statement, Delete):
+            return self._delete(statement)
+        elif isinstance(statement, CreateIndex):
+            return self._create_index(statement)
+        elif isinstance(statement, Vacuum):
+            return self._vacuum(statement)
         else:
             raise Exception("Неподдерживаемый SQL запрос")
 
-    def _create_table(self, sql):
-        match = re.match(r'CREATE TABLE (\w+) \((.*)\)', sql, re.IGNORECASE)
-        if not match:
-            raise Exception("Неправильный синтаксис CREATE TABLE")
+    def _create_table(self, statement):
+        table_name = statement.table_name
+        storage_type = (statement.storage_type or StorageType.ROW).lower()
+        if storage_type not in (StorageType.ROW, StorageType.COLUMNAR):
+            raise Exception(f"Неизвестный тип хранения {statement.storage_type}")
 
-        table_name = match.group(1)
-        cols_str = match.group(2)
+        # разобранный запрос лежит в кеше, поэтому столбцы копируются
+        columns = [Column.from_dict(col.to_dict()) for col in statement.columns]
 
-        columns = []
-        for col_def in cols_str.split(','):
-            col_def = col_def.strip()
-            if 'INT' in col_def.upper():
-                col_name = col_def.split()[0]
-                columns.append(Column(col_name, DataType.INT))
-            elif 'VARCHAR' in col_def.upper():
-                match_varchar = re.match(r'(\w+)\s+VARCHAR\((\d+)\)', col_def, re.IGNORECASE)
-                if match_varchar:
-                    col_name = match_varchar.group(1)
-                    size = int(match_varchar.group(2))
-                    columns.append(Column(col_name, DataType.VARCHAR, size))
-
-        schema = TableSchema(table_name, columns)
+        if sum(col.primary_key for col in columns) > 1:
+            raise Exception("В таблице может быть только один PRIMARY KEY")
+
+        schema = TableSchema(table_name, columns, storage_type)
         schema_file = os.path.join(self.db_path, f"{table_name}.schema")
-        data_file = os.path.join(self.db_path, f"{table_name}.data")
 
         schema.save_schema(schema_file)
-        self.tables[table_name] = BinaryStorage(data_file, schema)
+        if table_name in self.tables:
+            self.tables[table_name].close()
+        self.tables[table_name] = self._open_storage(schema)
+        self._drop_table_indexes(table_name)
+
+        # ограничения PRIMARY KEY и UNIQUE проверяются через уникальный индекс
+        for col in columns:
+            if col.unique:
+                self._build_index(table_name, col.name, unique=True)
 
         return f"Таблица {table_name} создана"
 
+    def _drop_table_indexes(self, table_name):
+        dropped = [key for key, entry in self.catalog['indexes'].items() if entry['table'] == table_name]
+        if not dropped:
+            return
+
+        for index_key in dropped:
+            index = self.indexes.pop(index_key, None)
+            if index is not None:
+                index.close()
+
+            index_file = os.path.join(self.db_path, self.catalog['indexes'].pop(index_key)['file'])
+            if os.path.exists(index_file):
+                os.remove(index_file)
+        self._write_catalog()
+
+    def _open_storage(self, schema):
+        if schema.storage_type == StorageType.COLUMNAR:
+            data_path = os.path.join(self.db_path, schema.table_name)
+            return ColumnarStorage(data_path, schema, self.sync_policy, self.vectorized_scans, self.buffer_pool)
+
+        data_file = os.path.join(self.db_path, f"{schema.table_name}.data")
+        return BinaryStorage(data_file, schema, self.sync_policy, self.vectorized_scans, self.buffer_pool)
+
     def _load_table(self, table_name):
         if table_name not in self.tables:
             schema_file = os.path.join(self.db_path, f"{table_name}.schema")
-            data_file = os.path.join(self.db_path, f"{table_name}.data")
 
             if not os.path.exists(schema_file):
                 raise Exception(f"Таблица {table_name} не существует")
 
             schema = TableSchema.load_schema(schema_file)
-            self.tables[table_name] = BinaryStorage(data_file, schema)
+            storage = self._open_storage(schema)
+            if schema.is_legacy_layout():
+                storage.upgrade_legacy_rows()
+                schema.save_schema(schema_file)
+            elif schema.stored_row_size != schema.row_size:
+                raise Exception(f"Файл таблицы {table_name} записан в неизвестном формате: "
+                                f"размер строки {schema.stored_row_size}, ожидалось {schema.row_size}")
+            self.tables[table_name] = storage
+
+            # индексы из каталога поднимаются с диска при первом обращении
+            for index_key, entry in self.catalog['indexes'].items():
+                if entry['table'] == table_name and index_key not in self.indexes:
+                    index_class = INDEX_TYPES[entry.get('type', 'number')]
+                    index_file = os.path.join(self.db_path, entry['file'])
+                    columns = self._index_columns(entry)
+                    if index_class.MULTI_COLUMN:
+                        self.indexes[index_key] = index_class.lazy(
+                            index_file, columns, entry.get('unique', False), entry.get('include'))
+                    else:
+                        self.indexes[index_key] = index_class.lazy(index_file, columns[0], entry.get('unique', False))
 
-    def _select(self, sql):
-        from_match = re.search(r'FROM (\w+)', sql, re.IGNORECASE)
-        if not from_match:
-            raise Exception("Неправильный синтаксис SELECT")
+    def _select(self, statement):
+        return list(self._select_rows(statement))
 
-        table_name = from_match.group(1)
+    def _select_rows(self, statement):
+        # план выполняется сразу, а строки отдаются конвейером генераторов по мере чтения
+        table_name = statement.table_name
         self._load_table(table_name)
         storage = self.tables[table_name]
 
-        where_match = re.search(r'WHERE (\w+) = (.+)', sql, re.IGNORECASE)
+        row_limit, offset = self._limit_offset(statement.limit, statement.offset)
+        plan = self._query_plan(table_name, storage, statement.columns, statement.where)
+        return self._run_select(plan, plan.expression, row_limit, offset)
 
-        if where_match:
-            col_name = where_match.group(1)
-            value_str = where_match.group(2).strip().strip('"\'')
+    def _query_plan(self, table_name, storage, columns, where):
+        col_indices = None
+        if columns is not None:
+            col_indices = [self._column_position(storage, col_name) for col_name in columns]
 
-            col_index = None
-            col_type = None
-            for i, col in enumerate(storage.schema.columns):
-                if col.name == col_name:
-                    col_index = i
-                    col_type = col.data_type
-                    break
+        plan = QueryPlan(table_name, storage, col_indices, self._resolve_where(where, storage),
+                         self._table_index_keys(table_name), self.catalog_version)
+        if plan.expression is None:
+            return plan
+
+        # читаем только нужные столбцы плюс столбцы условий
+        referenced = self._referenced_columns(plan.expression)
+        if col_indices is None:
+            plan.positions = {col_index: col_index for col_index in referenced}
+        else:
+            plan.scan_indices = col_indices + referenced
+            plan.positions = {col_index: len(col_indices) + i for i, col_index in enumerate(referenced)}
+        plan.scan_names = [storage.schema.columns[i].name
+                           for i in (plan.scan_indices or range(len(storage.schema.columns)))]
 
-            if col_index is None:
-                raise Exception(f"Столбец {col_name} не найден")
+        for col_name, _, op, _ in self._conjuncts(plan.expression):
+            index = self._plan_index(plan, col_name) if op == '=' else None
+            if index is not None and index.unique:
+                plan.first_match_only = True
+        return plan
 
-            if col_type == DataType.INT:
-                value = int(value_str)
+    def _run_select(self, plan, expression, row_limit, offset):
+        storage = plan.storage
+        if expression is None:
+            # без удаленных строк OFFSET - это сразу смещение offset * row_size в файле
+            if offset and storage.get_deleted_count() == 0:
+                stop = None if row_limit is None else offset + row_limit
+                return storage.iter_rows(start=offset, stop=stop, columns=plan.col_indices)
+            return limit(scan(storage, plan.col_indices), row_limit, offset)
+
+        predicate = self._compile_predicate(expression, plan.positions)
+
+        conditions = self._conjuncts(expression)
+        if plan.covering is None:
+            plan.covering = self._covering_index(plan, conditions) or False
+
+        first_match_only = False
+        if plan.covering:
+            rows = self._covering_rows(plan.covering, conditions)
+        else:
+            row_indices = self._plan(plan, expression)
+            first_match_only = plan.first_match_only
+            if row_indices is None:
+                rows = scan(storage, plan.scan_indices)
             else:
-                value = value_str
-
-            index_key = f"{table_name}_{col_name}"
-            if index_key in self.indexes and col_type == DataType.INT:
-                row_indices = self.indexes[index_key].find_rows(value)
-                rows = []
-                for row_idx in row_indices:
-                    row = storage.get_row(row_idx)
-                    if row:
-                        rows.append(row)
+                rows = fetch(storage, row_indices, plan.scan_indices)
+
+        # строки из индекса тоже проверяются: хеш-индекс может дать коллизию,
+        # а индекс покрывает не все условия
+        rows = filter_rows(rows, predicate)
+        if plan.scan_indices is not None:
+            rows = project(rows, len(plan.col_indices))
+        if first_match_only:
+            rows = limit(rows, 1)
+        if row_limit is not None or offset:
+            rows = limit(rows, row_limit, offset)
+        return rows
+
+    def _limit_offset(self, row_limit, offset):
+        values = []
+        for value in (row_limit, offset):
+            if value is not None:
+                value = int(value)
+                if value < 0:
+                    raise Exception("LIMIT и OFFSET должны быть неотрицательными")
+            values.append(value)
+        return values[0], values[1] or 0
+
+    def _column_position(self, storage, col_name):
+        for i, col in enumerate(storage.schema.columns):
+            if col.name == col_name:
+                return i
+        raise Exception(f"Столбец {col_name} не найден")
+
+    def _resolve_where(self, where, storage):
+        # дерево условий, в листьях - (столбец, позиция, оператор, значения нужного типа)
+        if where is None:
+            return None
+
+        if isinstance(where, (And, Or)):
+            items = []
+            for item in where.items:
+                item = self._resolve_where(item, storage)
+                # вложенные AND (и OR) одного вида сливаются в один узел
+                items.extend(item.items if type(item) is type(where) else [item])
+            return type(where)(items)
+        if isinstance(where, Not):
+            return Not(self._resolve_where(where.item, storage))
+
+        col_index = self._column_position(storage, where.column)
+        col_type = storage.schema.columns[col_index].data_type
+        if where.op in ('LIKE', 'MATCH') and col_type != DataType.VARCHAR:
+            raise Exception(f"{where.op} применим только к строковому столбцу {where.column}")
+
+        # параметры подготовленного запроса остаются слотами до _bind_expression
+        values = [value if isinstance(value, Param) else self._parse_value(col_type, value) for value in where.values]
+        return where.column, col_index, where.op, values
+
+    def _bind_expression(self, expression, params, storage):
+        if expression is None:
+            return None
+        if isinstance(expression, (And, Or)):
+            return type(expression)([self._bind_expression(item, params, storage) for item in expression.items])
+        if isinstance(expression, Not):
+            return Not(self._bind_expression(expression.item, params, storage))
+
+        col_name, col_index, op, values = expression
+        col_type = storage.schema.columns[col_index].data_type
+        values = [self._parse_value(col_type, params[value.index]) if isinstance(value, Param) else value
+                  for value in values]
+        return col_name, col_index, op, values
+
+    def _referenced_columns(self, expression):
+        if isinstance(expression, (And, Or)):
+            columns = []
+            for item in expression.items:
+                columns.extend(col_index for col_index in self._referenced_columns(item) if col_index not in columns)
+            return columns
+        if isinstance(expression, Not):
+            return self._referenced_columns(expression.item)
+        return [expression[1]]
+
+    def _conjuncts(self, expression):
+        # условия, которые обязаны выполняться для каждой строки результата
+        if isinstance(expression, And):
+            return [item for item in expression.items if isinstance(item, tuple)]
+        if isinstance(expression, tuple):
+            return [expression]
+        return []
+
+    def _compile_predicate(self, expression, positions):
+        # частый случай - только AND из простых условий - проверяется без трехзначной логики
+        conjuncts = self._conjuncts(expression)
+        if isinstance(expression, tuple) or isinstance(expression, And) and len(conjuncts) == len(expression.items):
+            matchers = [(positions[col_index], self._condition_matcher(op, values))
+                        for _, col_index, op, values in conjuncts]
+            return lambda row: all(matches(row[pos]) for pos, matches in matchers)
+
+        check = self._compile_expression(expression, positions)
+        return lambda row: check(row) is True
+
+    def _compile_expression(self, expression, positions):
+        # сравнение с NULL дает None (неизвестно), как в SQL: NOT не превращает его в истину
+        if isinstance(expression, (And, Or)):
+            checks = [self._compile_expression(item, positions) for item in expression.items]
+            stop = isinstance(expression, Or)
+
+            def check_all(row):
+                result = not stop
+                for check in checks:
+                    value = check(row)
+                    if value is stop:
+                        return stop
+                    if value is None:
+                        result = None
+                return result
+            return check_all
+
+        if isinstance(expression, Not):
+            check = self._compile_expression(expression.item, positions)
+
+            def check_not(row):
+                value = check(row)
+                return None if value is None else not value
+            return check_not
+
+        _, col_index, op, values = expression
+        pos = positions[col_index]
+        matches = self._condition_matcher(op, values)
+        return lambda row: None if row[pos] is None else matches(row[pos])
+
+    def _covering_index(self, plan, conditions):
+        # индекс, хранящий все нужные столбцы, отвечает на запрос без чтения файла данных;
+        # выбор зависит только от столбцов условий, поэтому сохраняется в плане
+        equal_names = {col_name for col_name, _, op, _ in conditions if op == '='}
+
+        for index, _ in self._table_indexes(plan.table_name, plan.storage):
+            covered = index.covered_columns()
+            if not set(plan.scan_names) <= set(covered):
+                continue
+
+            key_names = index.column_names if index.MULTI_COLUMN else [index.column_name]
+            prefix_names = []
+            for name in key_names:
+                if name not in equal_names:
+                    break
+                prefix_names.append(name)
+            if not prefix_names:
+                continue
+
+            return index, prefix_names, [covered.index(name) for name in plan.scan_names]
+
+        return None
+
+    def _covering_rows(self, covering, conditions):
+        index, prefix_names, positions = covering
+        equalities = {col_name: values[0] for col_name, _, op, values in conditions if op == '='}
+        prefix = [equalities[name] for name in prefix_names]
+        entries = index.find_covered(prefix if index.MULTI_COLUMN else prefix[0])
+        return ([values[pos] for pos in positions] for values in entries)
+
+    def _composite_candidate(self, plan, conditions):
+        # возвращает строки и столбцы, закрытые составным индексом с самым длинным префиксом из равенств;
+        # префикс из одного столбца обрабатывается в _condition_path
+        equalities = {col_name: values[0] for col_name, _, op, values in conditions if op == '='}
+
+        best_columns, best_prefix = None, 1
+        for _, columns in plan.index_keys:
+            if len(columns) < 2:
+                continue
+            prefix = 0
+            while prefix < len(columns) and columns[prefix] in equalities:
+                prefix += 1
+            if prefix > best_prefix:
+                best_columns, best_prefix = columns, prefix
+
+        if best_columns is None:
+            return None, []
+
+        key_columns = best_columns[:best_prefix]
+        index = self._plan_index(plan, *best_columns)
+        prefix = [equalities[name] for name in key_columns]
+        return (index.count_prefix(prefix), lambda: index.find_prefix(prefix)), key_columns
+
+    def _plan_index(self, plan, *col_names):
+        # индексы, найденные для запроса, запоминаются в плане вместе с отсутствующими
+        index = plan.candidates.get(col_names, False)
+        if index is False:
+            index = plan.candidates[col_names] = self._get_index(plan.table_name, *col_names)
+        return index
+
+    def _plan(self, plan, expression):
+        # возвращает номера строк-кандидатов (None - полный скан)
+        # больше кандидатов выбирать по номеру дороже, чем прочитать таблицу подряд
+        max_rows = plan.storage.get_row_count() / RANDOM_FETCH_COST
+        path = self._access_path(plan, expression, True, max_rows)
+        if path is None or path[0] > max_rows:
+            return None
+
+        row_ids = path[1]()
+        if len(row_ids) > max_rows:
+            row_ids = None
+        return row_ids
+
+    def _access_path(self, plan, expression, allow_scan, max_rows):
+        # путь доступа - (оценка числа строк по статистике индекса, функция построения списка строк)
+        # или None; списки строятся только после выбора путей по оценкам
+        if isinstance(expression, And):
+            return self._intersect_paths(plan, expression.items, allow_scan, max_rows)
+
+        if isinstance(expression, Or):
+            # OR объединяет списки ветвей; если хоть одна ветвь без индекса, нужен скан
+            bitmap = self._bitmap_union(plan, expression.items)
+            if bitmap is not None:
+                return bitmap_count(bitmap), lambda: bitmap_rows(bitmap)
+
+            paths = []
+            for item in expression.items:
+                path = self._access_path(plan, item, allow_scan, max_rows)
+                if path is None:
+                    return None
+                paths.append(path)
+
+            def fetch_union():
+                row_ids = set()
+                for _, fetch in paths:
+                    row_ids.update(fetch())
+                return sorted(row_ids)
+            return sum(estimate for estimate, _ in paths), fetch_union
+
+        if isinstance(expression, Not):
+            return None
+        return self._condition_path(plan, expression, allow_scan, max_rows)
+
+    def _intersect_paths(self, plan, items, allow_scan, max_rows):
+        paths = []
+        handled = set()
+        leaves = [item for item in items if isinstance(item, tuple)]
+
+        composite_path, composite_columns = self._composite_candidate(plan, leaves)
+        if composite_columns:
+            paths.append(composite_path)
+            handled.update(composite_columns)
+
+        # равенства по нескольким битовым индексам пересекаются через AND до чтения строк
+        bitmap, bitmap_columns = self._bitmap_intersection(plan, leaves)
+        if len(bitmap_columns) > 1:
+            paths.append((bitmap_count(bitmap), lambda: bitmap_rows(bitmap)))
+            handled.update(bitmap_columns)
+
+        for item in items:
+            if isinstance(item, tuple) and item[0] in handled:
+                continue
+            path = self._access_path(plan, item, False, max_rows)
+            if path is not None and path[0] <= max_rows:
+                paths.append(path)
+
+        # без подходящих индексов - одно векторизованное равенство вместо скана на Python
+        if not paths and allow_scan:
+            for item in leaves:
+                path = self._condition_path(plan, item, True, max_rows)
+                if path is not None:
+                    paths.append(path)
+                    break
+
+        if not paths:
+            return None
+
+        paths.sort(key=lambda path: path[0])
+
+        def fetch_intersection():
+            # начинаем с самого избирательного пути; следующий список строится,
+            # только пока это дешевле выборки уже найденных кандидатов
+            row_ids = set(paths[0][1]())
+            for estimate, fetch in paths[1:]:
+                if estimate >= len(row_ids) * RANDOM_FETCH_COST:
+                    break
+                row_ids.intersection_update(fetch())
+            return sorted(row_ids)
+        return paths[0][0], fetch_intersection
+
+    def _condition_path(self, plan, condition, allow_scan, max_rows):
+        col_name, col_index, op, values = condition
+        storage = plan.storage
+        index = self._plan_index(plan, col_name)
+
+        if op in ('=', 'IN'):
+            composite = self._leading_composite(plan, col_name) if index is None else None
+            if index is not None:
+                lookup, count = index.find_rows, index.count_rows
+            elif composite is not None:
+                lookup = lambda value: composite.find_prefix([value])
+                count = lambda value: composite.count_prefix([value])
+            elif allow_scan and storage.vectorized:
+                # размер результата прохода numpy заранее неизвестен, его проверяет _plan
+                lookup = lambda value: storage.find_row_ids(col_index, value)
+                count = lambda value: 0
             else:
-                all_rows = storage.get_all_rows()
-                rows = [row for row in all_rows if row[col_index] == value]
-        else:
-            rows = storage.get_all_rows()
+                return None
+
+            estimate = sum(count(value) for value in values)
+            if op == '=':
+                return estimate, lambda: lookup(values[0])
+
+            def fetch_in():
+                row_ids = set()
+                for value in values:
+                    row_ids.update(lookup(value))
+                return sorted(row_ids)
+            return estimate, fetch_in
+
+        if index is None:
+            return None
+
+        # MATCH пересекает списки строк полнотекстового индекса
+        if op == 'MATCH' and hasattr(index, 'find_match'):
+            return index.count_match(values[0]), lambda: index.find_match(values[0])
+
+        # LIKE 'abc%' по отсортированному индексу - диапазон строк с общим префиксом
+        if op == 'LIKE' and hasattr(index, 'find_starting_with'):
+            prefix = self._like_prefix(values[0])
+            if not prefix:
+                return None
+            return index.count_starting_with(prefix), lambda: index.find_starting_with(prefix)
+
+        # ширина диапазона считается по листьям B+-дерева и не дальше, чем нужно для сравнения со сканом
+        if op in RANGE_OPERATORS and hasattr(index, 'find_range'):
+            bounds = self._range_bounds(op, values)
+            return index.count_range(*bounds, limit=max_rows), lambda: index.find_range(*bounds)
+
+        return None
 
-        select_match = re.match(r'SELECT (.+?) FROM', sql, re.IGNORECASE)
-        if select_match:
-            cols_str = select_match.group(1).strip()
-            if cols_str == '*':
-                return rows
+    def _leading_composite(self, plan, col_name):
+        # составной индекс, который начинается с этого столбца, ищет по префиксу из одного значения
+        for _, columns in plan.index_keys:
+            if len(columns) > 1 and columns[0] == col_name:
+                return self._plan_index(plan, *columns)
+        return None
+
+    def _bitmap_intersection(self, plan, conditions):
+        bitmap = None
+        columns = []
+        for col_name, _, op, values in conditions:
+            index = self._plan_index(plan, col_name) if op == '=' else None
+            if index is not None and hasattr(index, 'find_bitmap'):
+                found = index.find_bitmap(values[0])
+                bitmap = found if bitmap is None else bitmap & found
+                columns.append(col_name)
+        return bitmap, columns
+
+    def _bitmap_union(self, plan, items):
+        # OR из равенств и IN по битовым индексам - одна операция OR над картами
+        bitmap = 0
+        for item in items:
+            if not isinstance(item, tuple) or item[2] not in ('=', 'IN'):
+                return None
+            index = self._plan_index(plan, item[0])
+            if index is None or not hasattr(index, 'find_bitmap'):
+                return None
+            for value in item[3]:
+                bitmap |= index.find_bitmap(value)
+        return bitmap
+
+    def _parse_value(self, col_type, value):
+        if value is None:
+            return None
+        if col_type == DataType.INT:
+            return int(value)
+        return str(value)
+
+    def _stored_value(self, col, value):
+        # значение в том виде, в каком его вернет чтение таблицы: VARCHAR обрезается до col.size байт,
+        # иначе индексы и проверка уникальности увидят строку, которой в файле нет
+        value = self._parse_value(col.data_type, value)
+        if col.data_type == DataType.VARCHAR and value is not None:
+            value = value.encode('utf-8')[:col.size].rstrip(b'\x00').decode('utf-8', errors='ignore') or None
+        return value
+
+    def _like_prefix(self, pattern):
+        return re.split(r'[%_]', pattern, 1)[0]
+
+    def _like_regex(self, pattern):
+        parts = []
+        for char in pattern:
+            if char == '%':
+                parts.append('.*')
+            elif char == '_':
+                parts.append('.')
             else:
-                col_names = [name.strip() for name in cols_str.split(',')]
-                col_indices = []
-                for col_name in col_names:
-                    for i, col in enumerate(storage.schema.columns):
-                        if col.name == col_name:
-                            col_indices.append(i)
-                            break
+                parts.append(re.escape(char))
+        return re.compile(''.join(parts), re.DOTALL)
 
-                return [[row[i] for i in col_indices] for row in rows]
+    def _condition_matcher(self, op, values):
+        if op == 'IN':
+            targets = set(values)
+            return lambda value: value is not None and value in targets
 
-        return rows
+        if op == 'MATCH':
+            terms = match_terms(values[0])
+            return lambda value: value is not None and terms <= set(tokenize(value))
+
+        if op == 'LIKE':
+            regex = self._like_regex(values[0])
+            return lambda value: value is not None and regex.fullmatch(value) is not None
+
+        if op == 'BETWEEN':
+            low, high = values
+            return lambda value: value is not None and low <= value <= high
 
-    def _insert(self, sql):
-        match = re.match(r'INSERT INTO (\w+) VALUES \((.+)\)', sql, re.IGNORECASE)
-        if not match:
-            raise Exception("Неправильный синтаксис INSERT")
+        compare = COMPARISON_OPERATORS[op]
+        target = values[0]
+        return lambda value: value is not None and compare(value, target)
 
-        table_name = match.group(1)
-        values_str = match.group(2)
+    def _range_bounds(self, op, values):
+        if op == 'BETWEEN':
+            return values[0], values[1], True, True
+        if op == '<':
+            return None, values[0], True, False
+        if op == '<=':
+            return None, values[0], True, True
+        if op == '>':
+            return values[0], None, False, True
+        return values[0], None, True, True
 
+    def _insert(self, statement):
+        table_name = statement.table_name
         self._load_table(table_name)
         storage = self.tables[table_name]
 
-        values = []
-        for i, val_str in enumerate(values_str.split(',')):
-            val_str = val_str.strip().strip('"\'')
-            col = storage.schema.columns[i]
+        rows = self._convert_rows(table_name, storage, statement.rows)
+        self._append_rows(table_name, storage, rows)
 
-            if col.data_type == DataType.INT:
-                values.append(int(val_str))
-            else:
-                values.append(val_str)
+        if len(rows) == 1:
+            return "Строка добавлена"
+        return f"Добавлено строк: {len(rows)}"
 
-        row_index = storage.get_row_count()
-        storage.insert_row(values)
+    def _convert_rows(self, table_name, storage, rows):
+        columns = storage.schema.columns
+        converted = []
+        for values in rows:
+            if len(values) > len(columns):
+                raise Exception(f"Слишком много значений для таблицы {table_name}")
+            converted.append([self._stored_value(col, value) for col, value in zip(columns, values)])
+        return converted
 
-        for i, col in enumerate(storage.schema.columns):
-            index_key = f"{table_name}_{col.name}"
-            if index_key in self.indexes and col.data_type == DataType.INT:
-                self.indexes[index_key].add_entry(values[i], row_index)
+    def insert_many(self, table_name, rows):
+        self._load_table(table_name)
+        storage = self.tables[table_name]
 
-        return "Строка добавлена"
+        # значения приводятся к типам столбцов до записи, иначе индексы получат ключи другого типа
+        rows = self._convert_rows(table_name, storage, rows)
+        return self._append_rows(table_name, storage, rows)
 
-    def _delete(self, sql):
-        if "DELETE *" in sql.upper():
-            match = re.search(r'FROM (\w+)', sql, re.IGNORECASE)
-            if not match:
-                raise Exception("Неправильный синтаксис DELETE")
+    def _append_rows(self, table_name, storage, rows):
+        if not rows:
+            return 0
 
-            table_name = match.group(1)
-            self._load_table(table_name)
-            storage = self.tables[table_name]
+        indexes = self._table_indexes(table_name, storage)
+        self._check_unique(table_name, storage, rows, indexes)
 
+        first_row_index = storage.insert_rows(rows)
+        storage.end_statement()
+
+        for index, positions in indexes:
+            index.add_entries([self._index_value(index, row, positions) for row in rows], first_row_index)
+
+        return len(rows)
+
+    def _check_unique(self, table_name, storage, rows, indexes):
+        for index, positions in indexes:
+            if not index.unique:
+                continue
+
+            i = positions[0]
+            col = storage.schema.columns[i]
+            seen = set()
+            for row in rows:
+                # сравнивается значение в том виде, в каком оно ляжет в файл
+                value = self._stored_value(col, row[i] if i < len(row) else None)
+                if not value:
+                    if col.primary_key:
+                        raise Exception(f"Первичный ключ {table_name}.{col.name} не может быть пустым")
+                    continue
+
+                duplicate = value in seen
+                for row_idx in index.find_rows(value):
+                    if duplicate:
+                        break
+                    duplicate = storage.get_row(row_idx, [i]) == [value]
+
+                if duplicate:
+                    raise Exception(f"Нарушение уникальности {table_name}.{col.name}: {value}")
+                seen.add(value)
+
+    def _delete(self, statement):
+        table_name = statement.table_name
+        self._load_table(table_name)
+        storage = self.tables[table_name]
+
+        if statement.all_rows:
             storage.delete_all_rows()
 
-            for col in storage.schema.columns:
-                index_key = f"{table_name}_{col.name}"
-                if index_key in self.indexes:
-                    self.indexes[index_key].clear_index()
+            for index_key, _ in self._table_index_keys(table_name):
+                index = self.indexes.get(index_key)
+                if index is not None:
+                    index.clear_index(storage)
 
             return "Все данные удалены"
         else:
-            where_match = re.search(r'WHERE (\w+) = (.+)', sql, re.IGNORECASE)
-            if not where_match:
-                raise Exception("Неправильный синтаксис DELETE")
+            plan = self._query_plan(table_name, storage, None, statement.where)
+            return self._delete_where(plan, plan.expression)
+
+    def _delete_where(self, plan, expression):
+        table_name = plan.table_name
+        storage = plan.storage
+        row_matches = self._compile_predicate(expression, plan.positions)
+
+        row_indices = self._plan(plan, expression)
+        if row_indices is None:
+            deleted = [(row_idx, row) for row_idx, row in storage.iter_rows(with_ids=True) if row_matches(row)]
+        else:
+            deleted = []
+            for row_idx in row_indices:
+                row = storage.get_row(row_idx)
+                if row is not None and row_matches(row):
+                    deleted.append((row_idx, row))
 
-            table_match = re.search(r'FROM (\w+)', sql, re.IGNORECASE)
-            if not table_match:
-                raise Exception("Неправильный синтаксис DELETE")
+        storage.delete_rows([row_idx for row_idx, _ in deleted])
+        storage.end_statement()
 
-            table_name = table_match.group(1)
-            col_name = where_match.group(1)
-            value_str = where_match.group(2).strip().strip('"\'')
+        # номера строк не меняются, поэтому из индексов убираются только удаленные записи
+        for index, positions in self._table_indexes(table_name, storage):
+            index.remove_entries([(self._index_value(index, row, positions), row_idx) for row_idx, row in deleted])
+            if deleted:
+                mark_stale(index.index_file)
 
-            self._load_table(table_name)
-            storage = self.tables[table_name]
+        row_count = storage.get_row_count()
+        if row_count and storage.get_deleted_count() / row_count >= self.vacuum_threshold:
+            self._vacuum_table(table_name)
 
+        return f"Строки с {self._expression_text(expression)} удалены"
+
+    def _expression_text(self, expression, nested=False):
+        if isinstance(expression, (And, Or)):
+            joiner = " AND " if isinstance(expression, And) else " OR "
+            text = joiner.join(self._expression_text(item, True) for item in expression.items)
+            return f"({text})" if nested else text
+        if isinstance(expression, Not):
+            return f"NOT {self._expression_text(expression.item, True)}"
+
+        col_name, _, op, values = expression
+        if op == 'BETWEEN':
+            return f"{col_name} BETWEEN {values[0]} AND {values[1]}"
+        if op == 'IN':
+            return f"{col_name} IN ({', '.join(str(value) for value in values)})"
+        return f"{col_name} {op} {values[0]}"
+
+    def _create_index(self, statement):
+        table_name = statement.table_name
+        col_names = list(statement.columns)
+        include_names = list(statement.include)
+        index_type = statement.index_type.lower() if statement.index_type else None
+        if index_type is not None and index_type not in INDEX_TYPES:
+            raise Exception(f"Неизвестный тип индекса {statement.index_type}")
+
+        self._load_table(table_name)
+        # несколько столбцов или INCLUDE хранит только составной индекс
+        if len(col_names) > 1 or include_names:
+            if index_type not in (None, 'composite'):
+                raise Exception(f"Индекс {index_type} не поддерживает несколько столбцов")
+            self._build_index(table_name, col_names, 'composite', include_names=include_names)
+            return f"Индекс на {table_name}({', '.join(col_names)}) создан"
+
+        self._build_index(table_name, col_names[0], index_type)
+
+        return f"Индекс на {table_name}.{col_names[0]} создан"
+
+    def _build_index(self, table_name, col_name, index_type=None, unique=False, include_names=None):
+        storage = self.tables[table_name]
+
+        # col_name - имя столбца или список имен для составного индекса
+        col_names = col_name if isinstance(col_name, list) else [col_name]
+        include_names = include_names or []
+        col_types = []
+        for name in col_names + include_names:
             col_type = None
             for col in storage.schema.columns:
-                if col.name == col_name:
+                if col.name == name:
                     col_type = col.data_type
+                    if len(col_names) == 1 and name == col_names[0]:
+                        unique = unique or col.unique
                     break
 
-            if col_type == DataType.INT:
-                value = int(value_str)
-            else:
-                value = value_str
+            if col_type is None:
+                raise Exception(f"Столбец {name} не найден")
+            col_types.append(col_type)
 
-            storage.delete_rows_by_condition(col_name, value)
+        if index_type is None:
+            index_type = DEFAULT_INDEX_TYPES[col_types[0]]
+        for name, col_type in zip(col_names + include_names, col_types):
+            if col_type not in INDEX_TYPES[index_type].DATA_TYPES:
+                raise Exception(f"Индекс {index_type} не поддерживает тип столбца {name}")
 
-            for col in storage.schema.columns:
-                index_key = f"{table_name}_{col.name}"
-                if index_key in self.indexes:
-                    self.indexes[index_key].rebuild_index(storage)
+        index_key = "_".join([table_name] + col_names)
+        index_file_name = f"{index_key}.index"
 
-            return f"Строки с {col_name} = {value} удалены"
+        if index_key in self.indexes:
+            self.indexes[index_key].close()
 
-    def _create_index(self, sql):
-        match = re.match(r'CREATE INDEX ON (\w+) \((\w+)\)', sql, re.IGNORECASE)
-        if not match:
-            raise Exception("Неправильный синтаксис CREATE INDEX")
+        index_class = INDEX_TYPES[index_type]
+        if index_class.MULTI_COLUMN:
+            index = index_class(os.path.join(self.db_path, index_file_name), col_names, unique, include_names)
+        else:
+            index = index_class(os.path.join(self.db_path, index_file_name), col_name, unique)
+        if os.path.exists(index.index_file):
+            os.remove(index.index_file)
+        index.rebuild_index(storage)
+        index.save(storage)
+        self.indexes[index_key] = index
 
-        table_name = match.group(1)
-        col_name = match.group(2)
+        self.catalog['indexes'][index_key] = {
+            'table': table_name,
+            'columns': col_names,
+            'include': include_names,
+            'file': index_file_name,
+            'type': index_type,
+            'unique': unique
+        }
+        self._write_catalog()
 
-        self._load_table(table_name)
-        storage = self.tables[table_name]
+        return index
 
-        col_found = False
-        for col in storage.schema.columns:
-            if col.name == col_name and col.data_type == DataType.INT:
-                col_found = True
-                break
+    def _vacuum(self, statement):
+        table_name = statement.table_name
+        self._load_table(table_name)
+        removed_count = self._vacuum_table(table_name)
 
-        if not col_found:
-            raise Exception(f"Столбец {col_name} не найден или не является INT")
+        return f"Таблица {table_name} сжата, освобождено строк: {removed_count}"
 
-        index_key = f"{table_name}_{col_name}"
-        index_file = os.path.join(self.db_path, f"{index_key}.index")
+    def _vacuum_table(self, table_name):
+        storage = self.tables[table_name]
+        removed_count = storage.vacuum()
 
-        index = NumberIndex(index_file, col_name)
-        index.rebuild_index(storage)
-        self.indexes[index_key] = index
+        # после сжатия номера строк меняются, индексы нужно перестроить
+        if removed_count:
+            storage.flush()
+            for index_key, _ in self._table_index_keys(table_name):
+                index = self.indexes.get(index_key)
+                if index is not None:
+                    index.rebuild_index(storage)
+                    index.save(storage)
 
-        return f"Индекс на {table_name}.{col_name} создан"
+        return removed_count
@@ -0,0 +1,36 @@
+# операторы конвейера SELECT: каждый принимает и отдает итератор строк,
+# поэтому строки идут по одной и ничего не накапливается в памяти
+
+def scan(storage, columns=None):
+    return storage.iter_rows(columns=columns)
+
+def fetch(storage, row_ids, columns=None):
+    for row_id in row_ids:
+        row = storage.get_row(row_id, columns)
+        if row is not None:
+            yield row
+
+def filter_rows(rows, predicate):
+    for row in rows:
+        if predicate(row):
+            yield row
+
+def project(rows, width):
+    for row in rows:
+        yield row[:width]
+
+def limit(rows, count, offset=0):
+    if count is not None and count <= 0:
+        return
+
+    produced = 0
+    for row in rows:
+        if offset:
+            offset -= 1
+            continue
+
+        yield row
+        produced += 1
+        if produced == count:
+            # источник дальше не читается
+            return
@@ -0,0 +1,161 @@
+import re
+import struct
+from index import SnapshotIndex
+from storage import DataType
+
+TERM_HEADER = struct.Struct('<HIQQ')
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# строки без слов попадают в список пустого термина, чтобы равенство по ним тоже находилось
+EMPTY_TERM = ''
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower()) if text else []
+
+def match_terms(query):
+    terms = set()
+    for part in query.split('&'):
+        terms.update(tokenize(part))
+
+    if not terms:
+        raise Exception(f"Пустой запрос MATCH '{query}'")
+    return terms
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_postings(data):
+    # список хранится как разности соседних номеров строк в varint
+    row_indices = []
+    row_index = 0
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        row_index += value
+        row_indices.append(row_index)
+        value = 0
+        shift = 0
+    return row_indices
+
+def encode_postings(row_indices):
+    out = bytearray()
+    previous = 0
+    for row_index in row_indices:
+        encode_varint(row_index - previous, out)
+        previous = row_index
+    return out
+
+class FullTextIndex(SnapshotIndex):
+    MAGIC = b'FIDX'
+    DATA_TYPES = (DataType.VARCHAR,)
+
+    def _clear(self):
+        # термин -> сжатый список строк, последний номер в списке и число номеров
+        self.postings = {}
+        self.last_row = {}
+        self.counts = {}
+        self.deleted = set()
+
+    def _append(self, term, row_index):
+        postings = self.postings.get(term)
+        if postings is None:
+            postings = self.postings[term] = bytearray()
+            self.last_row[term] = 0
+            self.counts[term] = 0
+
+        last_row = self.last_row[term]
+        if self.counts[term] and row_index <= last_row:
+            # номера идут не по возрастанию - список перекодируется целиком
+            row_indices = sorted(set(decode_postings(postings)) | {row_index})
+            self.postings[term] = encode_postings(row_indices)
+            self.last_row[term] = row_indices[-1]
+            self.counts[term] = len(row_indices)
+            return
+
+        encode_varint(row_index - last_row, postings)
+        self.last_row[term] = row_index
+        self.counts[term] += 1
+
+    def add_entry(self, value, row_index):
+        for term in set(tokenize(value)) or {EMPTY_TERM}:
+            self._append(term, row_index)
+        self.deleted.discard(row_index)
+        self.dirty = True
+
+    def remove_entry(self, value, row_index):
+        # удаленные строки отфильтровываются при поиске, списки чистит перестроение после VACUUM
+        self.deleted.add(row_index)
+        self.dirty = True
+
+    def _postings(self, terms):
+        # пересечение начинается с самого короткого списка
+        terms = sorted(terms, key=lambda term: self.counts.get(term, 0))
+        if not terms or terms[0] not in self.postings:
+            return []
+
+        row_indices = decode_postings(self.postings[terms[0]])
+        for term in terms[1:]:
+            if not row_indices:
+                break
+            other = set(decode_postings(self.postings[term]))
+            row_indices = [row_index for row_index in row_indices if row_index in other]
+
+        if self.deleted:
+            row_indices = [row_index for row_index in row_indices if row_index not in self.deleted]
+        return row_indices
+
+    def find_match(self, query):
+        return self._postings(match_terms(query))
+
+    def find_rows(self, value):
+        if not value:
+            return []
+        return self._postings(set(tokenize(value)) or {EMPTY_TERM})
+
+    def _count(self, terms):
+        # длина самого короткого списка - верхняя граница пересечения
+        return min(self.counts.get(term, 0) for term in terms)
+
+    def count_match(self, query):
+        return self._count(match_terms(query))
+
+    def count_rows(self, value):
+        if not value:
+            return 0
+        return self._count(set(tokenize(value)) or {EMPTY_TERM})
+
+    def _dump(self):
+        chunks = []
+        for term, postings in self.postings.items():
+            encoded = term.encode('utf-8')
+            chunks.append(TERM_HEADER.pack(len(encoded), len(postings), self.counts[term], self.last_row[term]))
+            chunks.append(encoded)
+            chunks.append(postings)
+
+        deleted = encode_postings(sorted(self.deleted))
+        chunks.append(TERM_HEADER.pack(0, len(deleted), len(self.deleted), 0))
+        chunks.append(deleted)
+        return len(self.postings), chunks
+
+    def _restore(self, data, pos, term_count):
+        for _ in range(term_count):
+            term_size, postings_size, count, last_row = TERM_HEADER.unpack_from(data, pos)
+            pos += TERM_HEADER.size
+            term = data[pos:pos + term_size].decode('utf-8')
+            pos += term_size
+
+            self.postings[term] = bytearray(data[pos:pos + postings_size])
+            self.counts[term] = count
+            self.last_row[term] = last_row
+            pos += postings_size
+
+        _, deleted_size, _, _ = TERM_HEADER.unpack_from(data, pos)
+        pos += TERM_HEADER.size
+        self.deleted = set(decode_postings(data[pos:pos + deleted_size]))
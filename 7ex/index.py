@@ -1,38 +1,610 @@
 import json
 import os
+import struct
+import hashlib
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from storage import DataType
 
-class NumberIndex:
-    def __init__(self, index_file, column_name):
+INDEX_HEADER = struct.Struct('<4sQQ')
+MAX_CHAR = chr(0x10FFFF)
+STALE_MAGIC = b'\x00' * 4
+
+def mark_stale(index_file):
+    # файл индекса помнит строки, которые уже удалены из таблицы; до следующего save
+    # сигнатура затирается, и после аварийного выхода load перестроит индекс по таблице
+    if os.path.exists(index_file):
+        with open(index_file, 'r+b') as f:
+            f.write(STALE_MAGIC)
+
+class BaseIndex(ABC):
+    # общий жизненный цикл индексов: ленивая загрузка из каталога, перестроение по таблице,
+    # проверка числа строк из заголовка файла и очистка; формат файла задают подклассы
+    MAGIC = None
+    DATA_TYPES = ()
+    MULTI_COLUMN = False
+
+    def __init__(self, index_file, column_name, unique=False):
         self.index_file = index_file
         self.column_name = column_name
-        self.index_data = {}
+        self.unique = unique
+        self.loaded = True
+        self.dirty = False
+        self._clear()
+
+    @abstractmethod
+    def _clear(self):
+        pass
 
+    @abstractmethod
     def add_entry(self, value, row_index):
-        if value not in self.index_data:
-            self.index_data[value] = []
-        self.index_data[value].append(row_index)
+        pass
 
+    @abstractmethod
+    def remove_entry(self, value, row_index):
+        pass
+
+    @abstractmethod
     def find_rows(self, value):
-        return self.index_data.get(value, [])
+        pass
 
-    def rebuild_index(self, storage):
-        self.index_data = {}
-        rows = storage.get_all_rows()
+    @abstractmethod
+    def count_rows(self, value):
+        pass
+
+    @abstractmethod
+    def save(self, storage):
+        pass
+
+    @abstractmethod
+    def load(self, storage):
+        pass
 
-        col_index = None
+    def add_entries(self, values, start_row_index):
+        for row_index, value in enumerate(values, start_row_index):
+            self.add_entry(value, row_index)
+
+    def remove_entries(self, entries):
+        for value, row_index in entries:
+            self.remove_entry(value, row_index)
+
+    def covered_columns(self):
+        return []
+
+    def _column_index(self, storage):
         for i, col in enumerate(storage.schema.columns):
             if col.name == self.column_name:
-                col_index = i
-                break
+                return i
+        return None
 
-        if col_index is None:
+    def _positions(self, storage):
+        # позиции столбцов, которые читаются из таблицы при перестроении
+        col_index = self._column_index(storage)
+        return None if col_index is None else [col_index]
+
+    def _add_rows(self, rows):
+        for row_index, row in rows:
+            self.add_entry(row[0], row_index)
+
+    def rebuild_index(self, storage, start_row_index=0):
+        if start_row_index == 0:
+            self._clear()
+            self.loaded = True
+        self.dirty = True
+
+        positions = self._positions(storage)
+        if positions is None:
             return
 
-        for row_index, row in enumerate(rows):
-            value = row[col_index]
-            self.add_entry(value, row_index)
+        self._add_rows(storage.iter_rows(start=start_row_index, with_ids=True, columns=positions))
 
-    def clear_index(self):
-        self.index_data = {}
+    def _is_outdated(self, magic, row_count, storage):
+        # файл не соответствует таблице (например, после VACUUM или аварийного выхода после DELETE)
+        return magic != self.MAGIC or row_count > storage.get_row_count()
+
+    def clear_index(self, storage):
+        self.close()
+        self._clear()
+        self.loaded = True
+        self.dirty = True
         if os.path.exists(self.index_file):
             os.remove(self.index_file)
+
+    def close(self):
+        pass
+
+    @classmethod
+    def lazy(cls, index_file, column_name, unique=False):
+        index = cls(index_file, column_name, unique)
+        index.loaded = False
+        return index
+
+class SnapshotIndex(BaseIndex):
+    # индекс, который целиком хранится в памяти и пишется в файл одним снимком после INDEX_HEADER
+    @abstractmethod
+    def _dump(self):
+        # число записей и части файла после заголовка
+        pass
+
+    @abstractmethod
+    def _restore(self, data, pos, entry_count):
+        pass
+
+    def save(self, storage):
+        entry_count, chunks = self._dump()
+
+        with open(self.index_file, 'wb') as f:
+            f.write(INDEX_HEADER.pack(self.MAGIC, storage.get_row_count(), entry_count))
+            for chunk in chunks:
+                f.write(chunk)
+
+        self.dirty = False
+
+    def load(self, storage):
+        self.loaded = True
+
+        if not os.path.exists(self.index_file):
+            self.rebuild_index(storage)
+            return
+
+        with open(self.index_file, 'rb') as f:
+            data = f.read()
+
+        magic, row_count, entry_count = INDEX_HEADER.unpack_from(data)
+        if self._is_outdated(magic, row_count, storage):
+            self.rebuild_index(storage)
+            return
+
+        self._clear()
+        self._restore(data, INDEX_HEADER.size, entry_count)
+        self.dirty = False
+
+        # строки, добавленные после последнего сохранения индекса
+        if row_count < storage.get_row_count():
+            self.rebuild_index(storage, row_count)
+
+class NumberIndex(SnapshotIndex):
+    MAGIC = b'NIDX'
+    DATA_TYPES = (DataType.INT,)
+
+    def _clear(self):
+        self.index_data = {}
+
+    def _key(self, value):
+        return value
+
+    def _add_key(self, key, row_index):
+        rows = self.index_data.get(key)
+        if rows is None:
+            self.index_data[key] = [row_index]
+        else:
+            rows.append(row_index)
+
+    def add_entry(self, value, row_index):
+        self._add_key(self._key(value), row_index)
+        self.dirty = True
+
+    def add_entries(self, values, start_row_index):
+        for row_index, value in enumerate(values, start_row_index):
+            self._add_key(self._key(value), row_index)
+        self.dirty = True
+
+    def remove_entry(self, value, row_index):
+        key = self._key(value)
+        rows = self.index_data.get(key)
+        if rows is not None and row_index in rows:
+            rows.remove(row_index)
+            if not rows:
+                del self.index_data[key]
+            self.dirty = True
+
+    def remove_entries(self, entries):
+        # удаления группируются по ключу, и список каждого ключа пересобирается один раз
+        removed_by_key = {}
+        for value, row_index in entries:
+            removed_by_key.setdefault(self._key(value), set()).add(row_index)
+
+        for key, removed in removed_by_key.items():
+            rows = self.index_data.get(key)
+            if rows is None:
+                continue
+            rows = [r for r in rows if r not in removed]
+            if rows:
+                self.index_data[key] = rows
+            else:
+                del self.index_data[key]
+            self.dirty = True
+
+    def find_rows(self, value):
+        return self.index_data.get(self._key(value), [])
+
+    def count_rows(self, value):
+        # оценка для планировщика: сколько строк вернет find_rows, без построения списка
+        return len(self.index_data.get(self._key(value), ()))
+
+    def covered_columns(self):
+        # значение ключа известно из самого запроса, поэтому индекс покрывает свой столбец
+        return [self.column_name]
+
+    def find_covered(self, value):
+        return [[value or None] for _ in self.find_rows(value)]
+
+    def _to_arrays(self):
+        keys = array('Q')
+        row_ids = array('q')
+        for key in sorted(self.index_data, key=lambda k: k or 0):
+            for row_index in sorted(self.index_data[key]):
+                keys.append(key or 0)
+                row_ids.append(row_index)
+        return keys, row_ids
+
+    def _from_arrays(self, keys, row_ids):
+        self.index_data = {}
+        for key, row_index in zip(keys, row_ids):
+            self._add_key(key or None, row_index)
+
+    def _dump(self):
+        keys, row_ids = self._to_arrays()
+        return len(keys), [keys.tobytes(), row_ids.tobytes()]
+
+    def _restore(self, data, pos, entry_count):
+        keys = array('Q')
+        row_ids = array('q')
+        keys_end = pos + entry_count * keys.itemsize
+        keys.frombytes(data[pos:keys_end])
+        row_ids.frombytes(data[keys_end:keys_end + entry_count * row_ids.itemsize])
+        self._from_arrays(keys, row_ids)
+
+class StringHashIndex(NumberIndex):
+    MAGIC = b'SIDX'
+    DATA_TYPES = (DataType.VARCHAR,)
+
+    # в индексе хранятся 64-битные хеши строк, совпадения проверяются по самой строке
+    def _key(self, value):
+        if not value:
+            return None
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def covered_columns(self):
+        # из-за коллизий хешей строку все равно нужно прочитать
+        return []
+
+class CompactNumberIndex(NumberIndex):
+    # формат файла совпадает с NumberIndex, массивы читаются и пишутся как есть
+    DELTA_LIMIT = 65536
+
+    def _clear(self):
+        self.keys = array('Q')
+        self.row_ids = array('q')
+        self.delta = {}
+        self.delta_size = 0
+        self.removed = set()
+
+    def _key(self, value):
+        return value or 0
+
+    def _add_key(self, key, row_index):
+        rows = self.delta.get(key)
+        if rows is None:
+            self.delta[key] = [row_index]
+        else:
+            rows.append(row_index)
+
+        self.delta_size += 1
+        if self.delta_size >= self.DELTA_LIMIT:
+            self._merge()
+
+    def _position(self, key, row_index):
+        lo = bisect_left(self.keys, key)
+        hi = bisect_right(self.keys, key, lo)
+        pos = bisect_left(self.row_ids, row_index, lo, hi)
+        if pos < hi and self.row_ids[pos] == row_index:
+            return pos
+        return None
+
+    def _merge(self):
+        if not self.delta and not self.removed:
+            return
+
+        # события слияния: удаление позиции (0) или вставка перед позицией (1)
+        events = [(self._position(key, row_index), 0, None) for key, row_index in self.removed]
+        for key, rows in self.delta.items():
+            lo = bisect_left(self.keys, key)
+            hi = bisect_right(self.keys, key, lo)
+            for row_index in rows:
+                events.append((bisect_left(self.row_ids, row_index, lo, hi), 1, (key, row_index)))
+        events.sort()
+
+        keys = array('Q')
+        row_ids = array('q')
+        prev = 0
+        for pos, kind, entry in events:
+            if pos > prev:
+                keys.extend(self.keys[prev:pos])
+                row_ids.extend(self.row_ids[prev:pos])
+            if kind == 0:
+                prev = pos + 1
+            else:
+                keys.append(entry[0])
+                row_ids.append(entry[1])
+                prev = max(prev, pos)
+
+        keys.extend(self.keys[prev:])
+        row_ids.extend(self.row_ids[prev:])
+
+        self.keys = keys
+        self.row_ids = row_ids
+        self.delta = {}
+        self.delta_size = 0
+        self.removed = set()
+
+    def remove_entry(self, value, row_index):
+        key = self._key(value)
+        rows = self.delta.get(key)
+        if rows is not None and row_index in rows:
+            rows.remove(row_index)
+            if not rows:
+                del self.delta[key]
+            self.delta_size -= 1
+            self.dirty = True
+        elif self._position(key, row_index) is not None:
+            self.removed.add((key, row_index))
+            self.dirty = True
+            if len(self.removed) >= self.DELTA_LIMIT:
+                self._merge()
+
+    # у сжатого индекса свое представление, удаления идут по одной записи
+    remove_entries = BaseIndex.remove_entries
+
+    def find_rows(self, value):
+        key = self._key(value)
+        lo = bisect_left(self.keys, key)
+        hi = bisect_right(self.keys, key, lo)
+
+        rows = self.row_ids[lo:hi].tolist()
+        if self.removed:
+            rows = [row_index for row_index in rows if (key, row_index) not in self.removed]
+        rows.extend(self.delta.get(key, ()))
+        return rows
+
+    def count_rows(self, value):
+        key = self._key(value)
+        return bisect_right(self.keys, key) - bisect_left(self.keys, key) + len(self.delta.get(key, ()))
+
+    def rebuild_index(self, storage, start_row_index=0):
+        if start_row_index:
+            super().rebuild_index(storage, start_row_index)
+            return
+
+        self._clear()
+        self.loaded = True
+        self.dirty = True
+
+        col_index = self._column_index(storage)
+        if col_index is None:
+            return
+
+        entries = sorted((row[0] or 0, row_index)
+                         for row_index, row in storage.iter_rows(with_ids=True, columns=[col_index]))
+        self.keys = array('Q', [key for key, _ in entries])
+        self.row_ids = array('q', [row_index for _, row_index in entries])
+
+    def _to_arrays(self):
+        self._merge()
+        return self.keys, self.row_ids
+
+    def _from_arrays(self, keys, row_ids):
+        self._clear()
+        self.keys = keys
+        self.row_ids = row_ids
+
+class SortedStringIndex(NumberIndex):
+    MAGIC = b'PIDX'
+    DATA_TYPES = (DataType.VARCHAR,)
+
+    # отсортированный список пар (строка, номер строки): префикс - непрерывный диапазон списка
+    def _clear(self):
+        self.entries = []
+
+    def add_entry(self, value, row_index):
+        insort(self.entries, (value or '', row_index))
+        self.dirty = True
+
+    remove_entries = BaseIndex.remove_entries
+
+    def add_entries(self, values, start_row_index):
+        self.entries.extend((value or '', row_index) for row_index, value in enumerate(values, start_row_index))
+        self.entries.sort()
+        self.dirty = True
+
+    def remove_entry(self, value, row_index):
+        entry = (value or '', row_index)
+        pos = bisect_left(self.entries, entry)
+        if pos < len(self.entries) and self.entries[pos] == entry:
+            del self.entries[pos]
+            self.dirty = True
+
+    def find_rows(self, value):
+        if not value:
+            return []
+
+        row_indices = []
+        pos = bisect_left(self.entries, (value,))
+        while pos < len(self.entries) and self.entries[pos][0] == value:
+            row_indices.append(self.entries[pos][1])
+            pos += 1
+        return row_indices
+
+    def find_starting_with(self, prefix):
+        row_indices = []
+        pos = bisect_left(self.entries, (prefix,))
+        while pos < len(self.entries) and self.entries[pos][0].startswith(prefix):
+            row_indices.append(self.entries[pos][1])
+            pos += 1
+        return row_indices
+
+    def count_rows(self, value):
+        if not value:
+            return 0
+        # ни одна строка не лежит между value и value + '\x00', кроме самой value
+        return bisect_left(self.entries, (value + '\x00',)) - bisect_left(self.entries, (value,))
+
+    def count_starting_with(self, prefix):
+        return bisect_left(self.entries, (prefix + MAX_CHAR,)) - bisect_left(self.entries, (prefix,))
+
+    def _add_rows(self, rows):
+        self.entries.extend((row[0] or '', row_index) for row_index, row in rows)
+        self.entries.sort()
+
+    def _dump(self):
+        row_ids = array('q', (row_index for _, row_index in self.entries))
+        encoded = [key.encode('utf-8') for key, _ in self.entries]
+        lengths = array('H', (len(key) for key in encoded))
+        return len(self.entries), [row_ids.tobytes(), lengths.tobytes(), b''.join(encoded)]
+
+    def _restore(self, data, pos, entry_count):
+        row_ids = array('q')
+        lengths = array('H')
+        row_ids.frombytes(data[pos:pos + entry_count * row_ids.itemsize])
+        pos += entry_count * row_ids.itemsize
+        lengths.frombytes(data[pos:pos + entry_count * lengths.itemsize])
+        pos += entry_count * lengths.itemsize
+
+        for row_index, length in zip(row_ids, lengths):
+            self.entries.append((data[pos:pos + length].decode('utf-8'), row_index))
+            pos += length
+
+class CompositeIndex(SnapshotIndex):
+    MAGIC = b'CIDX'
+    DATA_TYPES = (DataType.INT, DataType.VARCHAR)
+    MULTI_COLUMN = True
+
+    def __init__(self, index_file, column_names, unique=False, include_names=None):
+        self.column_names = column_names
+        self.include_names = include_names or []
+        self.columns = None
+        self.entry_struct = None
+        super().__init__(index_file, None, unique)
+
+    def _clear(self):
+        self.entries = []
+
+    def _bind(self, storage):
+        by_name = {col.name: col for col in storage.schema.columns}
+        self.columns = [by_name[name] for name in self.column_names + self.include_names]
+
+        fmt = '<'
+        for col in self.columns:
+            fmt += 'Q' if col.data_type == DataType.INT else f'{col.size}s'
+        self.entry_struct = struct.Struct(fmt + 'q')
+
+    def _normalize(self, values):
+        # NULL приводится к 0 или пустой строке, чтобы кортежи ключей оставались сравнимыми
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        return tuple((value or 0) if col.data_type == DataType.INT else (value or '')
+                     for col, value in zip(self.columns, values))
+
+    def _entry(self, values, row_index):
+        # запись - (ключ, номер строки, значения INCLUDE-столбцов)
+        values = self._normalize(values)
+        size = len(self.column_names)
+        return values[:size], row_index, values[size:]
+
+    def add_entry(self, values, row_index):
+        insort(self.entries, self._entry(values, row_index))
+        self.dirty = True
+
+    def add_entries(self, values_list, start_row_index):
+        self.entries.extend(self._entry(values, row_index)
+                            for row_index, values in enumerate(values_list, start_row_index))
+        self.entries.sort()
+        self.dirty = True
+
+    def remove_entry(self, values, row_index):
+        key, _, _ = self._entry(values, row_index)
+        pos = bisect_left(self.entries, (key, row_index))
+        if pos < len(self.entries) and self.entries[pos][:2] == (key, row_index):
+            del self.entries[pos]
+            self.dirty = True
+
+    def _prefix_bounds(self, values):
+        # записи с общим префиксом ключа идут подряд: начало ищется bisect по кортежу,
+        # конец - двоичным поиском по усеченным ключам
+        prefix = self._normalize(values)[:len(self.column_names)]
+        size = len(prefix)
+
+        lo = bisect_left(self.entries, (prefix,))
+        hi = len(self.entries)
+        start = lo
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entries[mid][0][:size] <= prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    def _prefix_range(self, values):
+        start, end = self._prefix_bounds(values)
+        return self.entries[start:end]
+
+    def find_prefix(self, values):
+        return [row_index for _, row_index, _ in self._prefix_range(values)]
+
+    def count_prefix(self, values):
+        start, end = self._prefix_bounds(values)
+        return end - start
+
+    def count_rows(self, values):
+        return self.count_prefix(values)
+
+    def find_rows(self, values):
+        return self.find_prefix(values)
+
+    def covered_columns(self):
+        return self.column_names + self.include_names
+
+    def find_covered(self, values):
+        # пустые значения возвращаются как None, так же как при чтении строки из хранилища
+        return [[value or None for value in key + included] for key, _, included in self._prefix_range(values)]
+
+    def _positions(self, storage):
+        self._bind(storage)
+        return [storage.schema.columns.index(col) for col in self.columns]
+
+    def _add_rows(self, rows):
+        self.entries.extend(self._entry(row, row_index) for row_index, row in rows)
+        self.entries.sort()
+
+    def _dump(self):
+        packed = []
+        for key, row_index, included in self.entries:
+            fields = [value.encode('utf-8') if isinstance(value, str) else value for value in key + included]
+            packed.append(self.entry_struct.pack(*fields, row_index))
+        return len(packed), [b''.join(packed)]
+
+    def _restore(self, data, pos, entry_count):
+        end = pos + entry_count * self.entry_struct.size
+        size = len(self.column_names)
+        for fields in self.entry_struct.iter_unpack(data[pos:end]):
+            values = tuple(value.rstrip(b'\x00').decode('utf-8', errors='ignore') if isinstance(value, bytes) else value
+                           for value in fields[:-1])
+            self.entries.append((values[:size], fields[-1], values[size:]))
+
+    def load(self, storage):
+        self._bind(storage)
+        super().load(storage)
+
+    def clear_index(self, storage):
+        # индекс из каталога мог еще не загружаться - типы столбцов берутся из схемы
+        self._bind(storage)
+        super().clear_index(storage)
+
+    @classmethod
+    def lazy(cls, index_file, column_names, unique=False, include_names=None):
+        index = cls(index_file, column_names, unique, include_names)
+        index.loaded = False
+        return index
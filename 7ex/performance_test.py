@@ -50,6 +50,8 @@ def test_select_performance():
         int_time_with_idx = time.time() - start_time
         int_times_with_index.append(int_time_with_idx)
 
+    db.close()
+
     plt.figure(figsize=(12, 4))
 
     plt.subplot(1, 3, 1)
@@ -128,6 +130,8 @@ def test_delete_performance():
         int_delete_time_with_idx = time.time() - start_time
         int_delete_times_with_index.append(int_delete_time_with_idx)
 
+    db.close()
+
     plt.figure(figsize=(12, 4))
 
     plt.subplot(1, 3, 1)
@@ -192,6 +196,8 @@ def test_insert_performance():
         insert_time_with_idx = time.time() - start_time
         insert_times_with_index.append(insert_time_with_idx)
 
+    db.close()
+
     plt.figure(figsize=(10, 6))
     plt.plot(batch_sizes, insert_times_no_index, 'r-o', label='Без индекса')
     plt.plot(batch_sizes, insert_times_with_index, 'g-o', label='С индексом')
@@ -208,9 +214,9 @@ def test_insert_performance():
 def run_all_tests():
     print("Запуск всех тестов СУБД")
 
-    db = SimpleDB("test_db")
-    result = db.execute_sql("CREATE TABLE test_table (id INT, name VARCHAR(50))")
-    print(f"Создание таблицы: {result}")
+    with SimpleDB("test_db") as db:
+        result = db.execute_sql("CREATE TABLE test_table (id INT, name VARCHAR(50))")
+        print(f"Создание таблицы: {result}")
 
     test_select_performance()
     test_delete_performance()
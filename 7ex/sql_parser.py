@@ -0,0 +1,448 @@
+import re
+import copy
+from functools import lru_cache
+from storage import Column, DataType
+
+PARSE_CACHE_SIZE = 256
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<number>-?\d+)
+      | (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+      | (?P<word>\w+)
+      | (?P<symbol><=|>=|<>|!=|[(),*=<>?;])
+    )""", re.VERBOSE)
+
+# литералы так же, как их выделяет TOKEN_PATTERN: строки целиком и числа, не входящие в слова
+LITERAL_PATTERN = re.compile(r"""('(?:[^']+|'')*'|"(?:[^"]+|"")*"|-?\b\d+\b)""")
+
+# запросы, в которых каждый литерал - значение, а не часть схемы вроде VARCHAR(10)
+TEMPLATE_STATEMENTS = ('INSERT', 'SELECT', 'DELETE')
+
+COMPARISONS = ('=', '<>', '!=', '<', '<=', '>', '>=')
+
+class Token:
+    def __init__(self, kind, value, position):
+        self.kind = kind
+        self.value = value
+        self.position = position
+
+    def is_word(self, *words):
+        return self.kind == 'word' and self.value.upper() in words
+
+    def is_symbol(self, *symbols):
+        return self.kind == 'symbol' and self.value in symbols
+
+def tokenize(sql):
+    tokens = []
+    pos = 0
+    end = len(sql.rstrip())
+    while pos < end:
+        match = TOKEN_PATTERN.match(sql, pos)
+        if not match:
+            raise Exception(f"Неожиданный символ в позиции {pos}: {sql[pos:pos + 10]!r}")
+        tokens.append(Token(match.lastgroup, match.group(match.lastgroup), match.start(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+def literal_value(text):
+    if text[0] in '\'"':
+        quote = text[0]
+        return text[1:-1].replace(quote * 2, quote)
+    return int(text)
+
+def is_count(value):
+    return value is None or (isinstance(value, int) and value >= 0)
+
+class Param:
+    # позиционный параметр ? подготовленного запроса
+    def __init__(self, index):
+        self.index = index
+
+class Condition:
+    def __init__(self, column, op, values):
+        self.column = column
+        self.op = op
+        self.values = values
+
+class And:
+    def __init__(self, items):
+        self.items = items
+
+class Or:
+    def __init__(self, items):
+        self.items = items
+
+class Not:
+    def __init__(self, item):
+        self.item = item
+
+class CreateTable:
+    def __init__(self, table_name, columns, storage_type):
+        self.table_name = table_name
+        self.columns = columns
+        self.storage_type = storage_type
+
+class CreateIndex:
+    def __init__(self, table_name, columns, include, index_type):
+        self.table_name = table_name
+        self.columns = columns
+        self.include = include
+        self.index_type = index_type
+
+class Insert:
+    def __init__(self, table_name, rows):
+        self.table_name = table_name
+        self.rows = rows
+
+class Select:
+    def __init__(self, table_name, columns, where, limit=None, offset=None):
+        self.table_name = table_name
+        self.columns = columns
+        self.where = where
+        self.limit = limit
+        self.offset = offset
+
+class Delete:
+    def __init__(self, table_name, where, all_rows=False):
+        self.table_name = table_name
+        self.where = where
+        self.all_rows = all_rows
+
+class Vacuum:
+    def __init__(self, table_name):
+        self.table_name = table_name
+
+class Parser:
+    # рекурсивный спуск по списку токенов, на каждое правило грамматики - свой метод
+    def __init__(self, sql):
+        self.tokens = tokenize(sql)
+        self.pos = 0
+        self.param_count = 0
+        self.statement = None
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise self._error()
+        self.pos += 1
+        return token
+
+    def _error(self):
+        return Exception(f"Неправильный синтаксис {self.statement}")
+
+    def _accept_word(self, *words):
+        token = self._peek()
+        if token is not None and token.is_word(*words):
+            self.pos += 1
+            return token.value.upper()
+        return None
+
+    def _expect_word(self, *words):
+        word = self._accept_word(*words)
+        if word is None:
+            raise self._error()
+        return word
+
+    def _accept_symbol(self, *symbols):
+        token = self._peek()
+        if token is not None and token.is_symbol(*symbols):
+            self.pos += 1
+            return token.value
+        return None
+
+    def _expect_symbol(self, *symbols):
+        symbol = self._accept_symbol(*symbols)
+        if symbol is None:
+            raise self._error()
+        return symbol
+
+    def _identifier(self):
+        token = self._next()
+        if token.kind != 'word':
+            raise self._error()
+        return token.value
+
+    def _identifier_list(self):
+        self._expect_symbol('(')
+        names = [self._identifier()]
+        while self._accept_symbol(','):
+            names.append(self._identifier())
+        self._expect_symbol(')')
+        return names
+
+    def _number(self):
+        token = self._next()
+        if token.kind != 'number':
+            raise self._error()
+        return int(token.value)
+
+    def _literal(self):
+        token = self._next()
+        if token.kind in ('number', 'string'):
+            return literal_value(token.value)
+        if token.is_symbol('?'):
+            self.param_count += 1
+            return Param(self.param_count - 1)
+        if token.is_word('NULL'):
+            return None
+        if token.kind == 'word':
+            # значение без кавычек, как раньше: WHERE name = John
+            return token.value
+        raise self._error()
+
+    def parse(self):
+        token = self._peek()
+        if token is None:
+            raise Exception("Неподдерживаемый SQL запрос")
+
+        if token.is_word('CREATE'):
+            self.pos += 1
+            if self._accept_word('TABLE'):
+                self.statement = 'CREATE TABLE'
+                node = self._create_table()
+            elif self._accept_word('INDEX'):
+                self.statement = 'CREATE INDEX'
+                node = self._create_index()
+            else:
+                raise Exception("Неподдерживаемый SQL запрос")
+        elif token.is_word('SELECT'):
+            self.statement = 'SELECT'
+            node = self._select()
+        elif token.is_word('INSERT'):
+            self.statement = 'INSERT'
+            node = self._insert()
+        elif token.is_word('DELETE'):
+            self.statement = 'DELETE'
+            node = self._delete()
+        elif token.is_word('VACUUM'):
+            self.statement = 'VACUUM'
+            self.pos += 1
+            node = Vacuum(self._identifier())
+        else:
+            raise Exception("Неподдерживаемый SQL запрос")
+
+        self._accept_symbol(';')
+        if self._peek() is not None:
+            raise self._error()
+
+        node.param_count = self.param_count
+        return node
+
+    def _create_table(self):
+        table_name = self._identifier()
+        self._expect_symbol('(')
+        columns = [self._column_def()]
+        while self._accept_symbol(','):
+            columns.append(self._column_def())
+        self._expect_symbol(')')
+
+        storage_type = None
+        if self._accept_word('STORAGE'):
+            storage_type = self._identifier()
+        return CreateTable(table_name, columns, storage_type)
+
+    def _column_def(self):
+        name = self._identifier()
+        type_name = self._expect_word('INT', 'INTEGER', 'VARCHAR')
+
+        if type_name == 'VARCHAR':
+            self._expect_symbol('(')
+            size = self._number()
+            self._expect_symbol(')')
+            data_type = DataType.VARCHAR
+        else:
+            size = None
+            data_type = DataType.INT
+
+        primary_key = unique = False
+        while True:
+            if self._accept_word('PRIMARY'):
+                self._expect_word('KEY')
+                primary_key = True
+            elif self._accept_word('UNIQUE'):
+                unique = True
+            else:
+                break
+        return Column(name, data_type, size, primary_key, unique)
+
+    def _create_index(self):
+        self._expect_word('ON')
+        table_name = self._identifier()
+        columns = self._identifier_list()
+
+        include = []
+        if self._accept_word('INCLUDE'):
+            include = self._identifier_list()
+
+        index_type = None
+        if self._accept_word('USING'):
+            index_type = self._identifier()
+        return CreateIndex(table_name, columns, include, index_type)
+
+    def _select(self):
+        self._expect_word('SELECT')
+        if self._accept_symbol('*'):
+            columns = None
+        else:
+            columns = [self._identifier()]
+            while self._accept_symbol(','):
+                columns.append(self._identifier())
+
+        self._expect_word('FROM')
+        table_name = self._identifier()
+        where = self._where()
+
+        self.statement = 'SELECT'
+        limit = offset = None
+        if self._accept_word('LIMIT'):
+            limit = self._count()
+            if self._accept_word('OFFSET'):
+                offset = self._count()
+        return Select(table_name, columns, where, limit, offset)
+
+    def _count(self):
+        value = self._literal()
+        if not isinstance(value, Param) and not is_count(value):
+            raise self._error()
+        return value
+
+    def _insert(self):
+        self._expect_word('INSERT')
+        self._expect_word('INTO')
+        table_name = self._identifier()
+        self._expect_word('VALUES')
+
+        rows = [self._values_tuple()]
+        while self._accept_symbol(','):
+            rows.append(self._values_tuple())
+        return Insert(table_name, rows)
+
+    def _values_tuple(self):
+        self._expect_symbol('(')
+        values = [self._literal()]
+        while self._accept_symbol(','):
+            values.append(self._literal())
+        self._expect_symbol(')')
+        return values
+
+    def _delete(self):
+        self._expect_word('DELETE')
+        all_rows = self._accept_symbol('*') is not None
+        self._expect_word('FROM')
+        table_name = self._identifier()
+        if all_rows:
+            return Delete(table_name, None, all_rows=True)
+
+        where = self._where()
+        if where is None:
+            raise self._error()
+        return Delete(table_name, where)
+
+    def _where(self):
+        if not self._accept_word('WHERE'):
+            return None
+
+        self.statement = 'WHERE'
+        return self._or_expression()
+
+    # приоритет: NOT сильнее AND, AND сильнее OR
+    def _or_expression(self):
+        items = [self._and_expression()]
+        while self._accept_word('OR'):
+            items.append(self._and_expression())
+        return items[0] if len(items) == 1 else Or(items)
+
+    def _and_expression(self):
+        items = [self._not_expression()]
+        while self._accept_word('AND'):
+            items.append(self._not_expression())
+        return items[0] if len(items) == 1 else And(items)
+
+    def _not_expression(self):
+        if self._accept_word('NOT'):
+            return Not(self._not_expression())
+        if self._accept_symbol('('):
+            expression = self._or_expression()
+            self._expect_symbol(')')
+            return expression
+        return self._condition()
+
+    def _condition(self):
+        column = self._identifier()
+        negated = self._accept_word('NOT') is not None
+
+        if self._accept_word('BETWEEN'):
+            low = self._literal()
+            self._expect_word('AND')
+            condition = Condition(column, 'BETWEEN', [low, self._literal()])
+        elif self._accept_word('IN'):
+            self._expect_symbol('(')
+            values = [self._literal()]
+            while self._accept_symbol(','):
+                values.append(self._literal())
+            self._expect_symbol(')')
+            condition = Condition(column, 'IN', values)
+        elif negated:
+            condition = Condition(column, self._expect_word('LIKE'), [self._literal()])
+        else:
+            op = self._accept_word('LIKE', 'MATCH') or self._expect_symbol(*COMPARISONS)
+            condition = Condition(column, '<>' if op == '!=' else op, [self._literal()])
+
+        return Not(condition) if negated else condition
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_cached(sql):
+    # разобранные деревья не изменяются при выполнении, поэтому их можно переиспользовать
+    return Parser(sql).parse()
+
+def parse_sql(sql):
+    # запросы, отличающиеся только значениями, разбираются один раз: литералы заменяются на ?,
+    # шаблон берется из кеша, а значения подставляются как параметры
+    if sql[:6].upper() in TEMPLATE_STATEMENTS:
+        parts = LITERAL_PATTERN.split(sql)
+        template = '?'.join(parts[0::2])
+        # в самом запросе есть ? - это запрос для prepare, его параметры не смешиваются с литералами
+        if template.count('?') == len(parts) // 2:
+            statement = bind_params(_parse_cached(template), [literal_value(text) for text in parts[1::2]])
+            # в шаблоне LIMIT и OFFSET были параметрами, их значения проверяются после подстановки
+            if isinstance(statement, Select) and not (is_count(statement.limit) and is_count(statement.offset)):
+                raise Exception("Неправильный синтаксис SELECT")
+            return statement
+    return _parse_cached(sql)
+
+def bind_value(value, params):
+    return params[value.index] if isinstance(value, Param) else value
+
+def bind_expression(expression, params):
+    if isinstance(expression, And):
+        return And([bind_expression(item, params) for item in expression.items])
+    if isinstance(expression, Or):
+        return Or([bind_expression(item, params) for item in expression.items])
+    if isinstance(expression, Not):
+        return Not(bind_expression(expression.item, params))
+    return Condition(expression.column, expression.op, [bind_value(value, params) for value in expression.values])
+
+def bind_params(statement, params):
+    # дерево из кеша не меняется - подстановка параметров создает копию
+    if len(params) != statement.param_count:
+        raise Exception(f"Ожидалось параметров: {statement.param_count}, передано: {len(params)}")
+    if not statement.param_count:
+        return statement
+
+    if isinstance(statement, Insert):
+        bound = Insert(statement.table_name, [[bind_value(value, params) for value in row] for row in statement.rows])
+        bound.param_count = 0
+        return bound
+
+    bound = copy.copy(statement)
+    bound.param_count = 0
+    if statement.where is not None:
+        bound.where = bind_expression(statement.where, params)
+    if isinstance(statement, Select):
+        bound.limit = bind_value(statement.limit, params)
+        bound.offset = bind_value(statement.offset, params)
+    return bound
@@ -1,48 +1,128 @@
 import struct
 import os
 import json
+import mmap
+import time
+from buffer_pool import PAGE_SIZE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_CHUNK_ROWS = 4096
+WRITE_BUFFER_SIZE = 64 * 1024
+
+ROW_LIVE = 0
+ROW_DELETED = 1
 
 class DataType:
     INT = 1
     VARCHAR = 2
 
+class StorageType:
+    ROW = 'row'
+    COLUMNAR = 'columnar'
+
+class SyncPolicy:
+    STATEMENT = 'statement'
+    ROWS = 'rows'
+    INTERVAL = 'interval'
+    NEVER = 'never'
+
+    def __init__(self, mode=NEVER, rows=1000, interval=1.0):
+        if mode not in (self.STATEMENT, self.ROWS, self.INTERVAL, self.NEVER):
+            raise Exception(f"Неизвестный режим fsync: {mode}")
+
+        self.mode = mode
+        self.rows = rows
+        self.interval = interval
+
 class Column:
-    def __init__(self, name, data_type, size=None):
+    def __init__(self, name, data_type, size=None, primary_key=False, unique=False):
         self.name = name
         self.data_type = data_type
         self.size = size
+        self.primary_key = primary_key
+        self.unique = unique or primary_key
 
     def to_dict(self):
         return {
             'name': self.name,
             'data_type': self.data_type,
-            'size': self.size
+            'size': self.size,
+            'primary_key': self.primary_key,
+            'unique': self.unique
         }
 
     @classmethod
     def from_dict(cls, data):
-        return cls(data['name'], data['data_type'], data['size'])
+        return cls(data['name'], data['data_type'], data['size'],
+                   data.get('primary_key', False), data.get('unique', False))
 
 class TableSchema:
-    def __init__(self, table_name, columns):
+    def __init__(self, table_name, columns, storage_type=StorageType.ROW):
         self.table_name = table_name
         self.columns = columns
+        self.storage_type = storage_type
+        self.row_struct = self._compile_struct()
         self.row_size = self._calculate_row_size()
-
-    def _calculate_row_size(self):
-        size = 0
+        self.varchar_indices = [i for i, col in enumerate(columns) if col.data_type == DataType.VARCHAR]
+        self.rows_per_page = max(1, PAGE_SIZE // self.row_size)
+        self._numpy_dtype = None
+        self._projections = {}
+        self.stored_row_size = self.row_size
+
+    def _compile_struct(self):
+        # первый байт слота - флаг удаления строки
+        fmt = '<B'
         for col in self.columns:
             if col.data_type == DataType.INT:
-                size += 8
+                fmt += 'Q'
             elif col.data_type == DataType.VARCHAR:
-                size += col.size
-        return size
+                fmt += f'{col.size}s'
+        return struct.Struct(fmt)
+
+    def _calculate_row_size(self):
+        return self.row_struct.size
+
+    def projection(self, columns):
+        # struct того же размера, что и строка, но ненужные столбцы пропускаются байтами 'x'
+        # и не распаковываются; возвращает struct, позиции строк в нем и порядок выдачи
+        key = tuple(columns)
+        projection = self._projections.get(key)
+        if projection is None:
+            wanted = sorted(set(key))
+            fmt = '<B'
+            for i, col in enumerate(self.columns):
+                if col.data_type == DataType.INT:
+                    fmt += 'Q' if i in wanted else '8x'
+                else:
+                    fmt += f'{col.size}s' if i in wanted else f'{col.size}x'
+
+            varchar_positions = [pos for pos, i in enumerate(wanted) if self.columns[i].data_type == DataType.VARCHAR]
+            order = [wanted.index(i) for i in key]
+            projection = (struct.Struct(fmt), varchar_positions, order)
+            self._projections[key] = projection
+        return projection
+
+    def numpy_dtype(self):
+        if self._numpy_dtype is None:
+            fields = [('#flag', 'u1')]
+            for col in self.columns:
+                if col.data_type == DataType.INT:
+                    fields.append((col.name, '<u8'))
+                elif col.data_type == DataType.VARCHAR:
+                    fields.append((col.name, f'S{col.size}'))
+            self._numpy_dtype = np.dtype(fields)
+        return self._numpy_dtype
 
     def save_schema(self, schema_file):
         schema_data = {
             'table_name': self.table_name,
             'columns': [col.to_dict() for col in self.columns],
-            'row_size': self.row_size
+            'row_size': self.row_size,
+            'storage_type': self.storage_type
         }
         with open(schema_file, 'w') as f:
             json.dump(schema_data, f)
@@ -53,15 +133,133 @@ class TableSchema:
             schema_data = json.load(f)
 
         columns = [Column.from_dict(col_data) for col_data in schema_data['columns']]
-        return cls(schema_data['table_name'], columns)
+        schema = cls(schema_data['table_name'], columns, schema_data.get('storage_type', StorageType.ROW))
+        # размер строки, с которым записан файл данных; у таблиц старого формата нет байта флага
+        schema.stored_row_size = schema_data.get('row_size', schema.row_size)
+        return schema
+
+    def is_legacy_layout(self):
+        return self.storage_type == StorageType.ROW and self.stored_row_size == self.row_size - 1
 
 class BinaryStorage:
-    def __init__(self, data_file, schema):
+    def __init__(self, data_file, schema, sync_policy=None, vectorized=True, buffer_pool=None):
         self.data_file = data_file
         self.schema = schema
+        self.sync_policy = sync_policy or SyncPolicy()
+        self.vectorized = vectorized and np is not None
+        self.buffer_pool = buffer_pool
+        self._mm = None
+        self._mm_file = None
+        self._deleted_count = None
+        self._row_count = None
+        self._write_handle = None
+        self._write_buffer = bytearray()
+        self._unsynced_rows = 0
+        self._last_sync = time.monotonic()
+
+    def _get_mapping(self):
+        self._flush_buffer()
+
+        if self._mm is None:
+            if not os.path.exists(self.data_file) or os.path.getsize(self.data_file) == 0:
+                return None
+
+            self._mm_file = open(self.data_file, 'rb')
+            self._mm = mmap.mmap(self._mm_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._mm
+
+    def _close_mapping(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._mm_file is not None:
+            self._mm_file.close()
+            self._mm_file = None
+
+    def _close_write_handle(self):
+        if self._write_handle is not None:
+            self._write_handle.close()
+            self._write_handle = None
+
+    def _flush_buffer(self):
+        if not self._write_buffer:
+            return
+
+        if self._write_handle is None:
+            self._write_handle = open(self.data_file, 'ab', buffering=0)
+
+        if self.buffer_pool is not None:
+            # последняя неполная страница в пуле устаревает после дозаписи
+            first_new_row = self._row_count - len(self._write_buffer) // self.schema.row_size
+            self.buffer_pool.invalidate(self.data_file, first_new_row // self.schema.rows_per_page)
+
+        self._write_handle.write(self._write_buffer)
+        self._write_buffer.clear()
+
+        # файл вырос - отображение пересоздается при следующем чтении
+        self._close_mapping()
+
+    def _fsync(self):
+        self._flush_buffer()
+
+        if os.path.exists(self.data_file):
+            if self._write_handle is None:
+                self._write_handle = open(self.data_file, 'ab', buffering=0)
+            os.fsync(self._write_handle.fileno())
+
+        self._unsynced_rows = 0
+        self._last_sync = time.monotonic()
+
+    def _replace_data_file(self, tmp_file):
+        # при любой политике, кроме NEVER, новый файл попадает на диск до подмены, а переименование в папке -
+        # после нее; иначе сбой сразу после VACUUM оставит пустой или неполный файл таблицы
+        durable = self.sync_policy.mode != SyncPolicy.NEVER
+        if durable:
+            with open(tmp_file, 'rb') as f:
+                os.fsync(f.fileno())
+
+        os.replace(tmp_file, self.data_file)
+
+        if durable and hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.data_file)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def _after_write(self, row_count):
+        self._unsynced_rows += row_count
+        policy = self.sync_policy
+
+        if policy.mode == SyncPolicy.ROWS and self._unsynced_rows >= policy.rows:
+            self._fsync()
+        elif policy.mode == SyncPolicy.INTERVAL and time.monotonic() - self._last_sync >= policy.interval:
+            self._fsync()
+        elif len(self._write_buffer) >= WRITE_BUFFER_SIZE:
+            self._flush_buffer()
+
+    def end_statement(self):
+        # после каждого запроса строки уходят в ОС при любой политике,
+        # политика определяет только, когда вызывается fsync
+        if self.sync_policy.mode == SyncPolicy.STATEMENT:
+            self._fsync()
+        else:
+            self._flush_buffer()
+
+    def flush(self):
+        if self.sync_policy.mode == SyncPolicy.NEVER:
+            self._flush_buffer()
+        else:
+            self._fsync()
+
+    def close(self):
+        self.flush()
+        self._close_write_handle()
+        self._close_mapping()
 
     def pack_row(self, values):
-        packed_data = b''
+        fields = [ROW_LIVE]
 
         for i, col in enumerate(self.schema.columns):
             if i >= len(values):
@@ -70,97 +268,228 @@ class BinaryStorage:
                 value = values[i]
 
             if col.data_type == DataType.INT:
-                if value is None:
-                    packed_data += struct.pack('<Q', 0)
-                else:
-                    packed_data += struct.pack('<Q', int(value))
-
+                fields.append(0 if value is None else int(value))
             elif col.data_type == DataType.VARCHAR:
-                if value is None:
-                    value = ""
+                value_str = "" if value is None else str(value)
+                # struct сам обрезает и дополняет нулями до col.size байт
+                fields.append(value_str[:col.size].encode('utf-8'))
 
-                value_str = str(value)
-                if len(value_str) > col.size:
-                    value_str = value_str[:col.size]
+        return self.schema.row_struct.pack(*fields)
 
-                value_bytes = value_str.encode('utf-8')
-                if len(value_bytes) > col.size:
-                    value_bytes = value_bytes[:col.size]
-
-                padded_value = value_bytes.ljust(col.size, b'\x00')
-                packed_data += padded_value
-
-        return packed_data
+    def _decode_values(self, raw_values):
+        values = list(raw_values[1:])
+        for i in self.schema.varchar_indices:
+            values[i] = values[i].rstrip(b'\x00').decode('utf-8', errors='ignore')
+        return [value or None for value in values]
 
     def unpack_row(self, packed_data):
-        values = []
-        offset = 0
+        return self._decode_values(self.schema.row_struct.unpack(packed_data))
 
-        for col in self.schema.columns:
-            if col.data_type == DataType.INT:
-                value = struct.unpack('<Q', packed_data[offset:offset+8])[0]
-                if value == 0:
-                    values.append(None)
-                else:
-                    values.append(value)
-                offset += 8
+    def _decode_projection(self, raw_values, projection):
+        _, varchar_positions, order = projection
+        values = list(raw_values[1:])
+        for i in varchar_positions:
+            values[i] = values[i].rstrip(b'\x00').decode('utf-8', errors='ignore')
+        return [values[i] or None for i in order]
 
-            elif col.data_type == DataType.VARCHAR:
-                value_bytes = packed_data[offset:offset+col.size]
-                value_str = value_bytes.rstrip(b'\x00').decode('utf-8', errors='ignore')
-                values.append(value_str if value_str else None)
-                offset += col.size
-
-        return values
+    def unpack_rows(self, packed_data):
+        return [self._decode_values(raw) for raw in self.schema.row_struct.iter_unpack(packed_data)
+                if raw[0] == ROW_LIVE]
 
     def insert_row(self, values):
-        packed_row = self.pack_row(values)
+        row_count = self.get_row_count()
+        self._write_buffer += self.pack_row(values)
+        self._row_count = row_count + 1
+        self._after_write(1)
 
-        with open(self.data_file, 'ab') as f:
-            f.write(packed_row)
+    def insert_rows(self, rows):
+        first_row_index = self.get_row_count()
+        packed_rows = b''.join([self.pack_row(values) for values in rows])
+        row_count = len(packed_rows) // self.schema.row_size
+
+        self._write_buffer += packed_rows
+        self._row_count = first_row_index + row_count
+        self._after_write(row_count)
+
+        return first_row_index
 
     def get_row_count(self):
-        if not os.path.exists(self.data_file):
-            return 0
+        if self._row_count is None:
+            self._flush_buffer()
+            if os.path.exists(self.data_file):
+                self._row_count = os.path.getsize(self.data_file) // self.schema.row_size
+            else:
+                self._row_count = 0
 
-        file_size = os.path.getsize(self.data_file)
-        return file_size // self.schema.row_size
+        return self._row_count
 
-    def get_row(self, row_index):
-        if not os.path.exists(self.data_file):
-            return None
+    def _read_page(self, page_no):
+        mm = self._get_mapping()
+        page_bytes = self.schema.rows_per_page * self.schema.row_size
+        return mm[page_no * page_bytes:(page_no + 1) * page_bytes]
 
-        with open(self.data_file, 'rb') as f:
-            f.seek(row_index * self.schema.row_size)
-            packed_data = f.read(self.schema.row_size)
+    def get_row(self, row_index, columns=None):
+        mm = self._get_mapping()
+        if mm is None or row_index < 0:
+            return None
 
-            if len(packed_data) < self.schema.row_size:
+        row_size = self.schema.row_size
+        if self.buffer_pool is not None:
+            if row_index >= len(mm) // row_size:
                 return None
 
+            page_no, slot = divmod(row_index, self.schema.rows_per_page)
+            page = self.buffer_pool.get_page(self.data_file, page_no, self._read_page)
+            packed_data = page[slot * row_size:(slot + 1) * row_size]
+        else:
+            offset = row_index * row_size
+            packed_data = mm[offset:offset + row_size]
+
+        if len(packed_data) < row_size or packed_data[0] != ROW_LIVE:
+            return None
+
+        if columns is None:
             return self.unpack_row(packed_data)
 
+        projection = self.schema.projection(columns)
+        return self._decode_projection(projection[0].unpack(packed_data), projection)
+
     def get_all_rows(self):
-        if not os.path.exists(self.data_file):
+        mm = self._get_mapping()
+        if mm is None:
             return []
 
-        rows = []
+        row_size = self.schema.row_size
+        end = (len(mm) // row_size) * row_size
+
+        return self.unpack_rows(mm[:end])
+
+    def get_deleted_count(self):
+        if self._deleted_count is None:
+            mm = self._get_mapping()
+            if mm is None:
+                return 0
+
+            row_size = self.schema.row_size
+            end = (len(mm) // row_size) * row_size
+            self._deleted_count = mm[0:end:row_size].count(ROW_DELETED)
+
+        return self._deleted_count
+
+    def get_live_row_count(self):
+        return self.get_row_count() - self.get_deleted_count()
+
+    def iter_rows(self, start=0, stop=None, chunk_rows=DEFAULT_CHUNK_ROWS, with_ids=False, columns=None):
+        row_size = self.schema.row_size
         row_count = self.get_row_count()
 
-        for i in range(row_count):
-            row = self.get_row(i)
-            if row is not None:
-                rows.append(row)
+        # при выборке части столбцов остальные поля не распаковываются
+        if columns is None:
+            row_struct = self.schema.row_struct
+            decode = self._decode_values
+        else:
+            projection = self.schema.projection(columns)
+            row_struct = projection[0]
+            decode = lambda raw_values: self._decode_projection(raw_values, projection)
+
+        if stop is None or stop > row_count:
+            stop = row_count
+
+        position = max(start, 0)
+        while position < stop:
+            mm = self._get_mapping()
+            if mm is None:
+                return
+
+            chunk_end = min(position + chunk_rows, stop)
+            chunk = mm[position * row_size:chunk_end * row_size]
+
+            for row_id, raw_values in enumerate(row_struct.iter_unpack(chunk), position):
+                if raw_values[0] != ROW_LIVE:
+                    continue
+
+                row = decode(raw_values)
+                if with_ids:
+                    yield row_id, row
+                else:
+                    yield row
 
-        return rows
+            position = chunk_end
 
     def delete_all_rows(self):
+        self._write_buffer.clear()
+        self._close_write_handle()
+        self._close_mapping()
+        if self.buffer_pool is not None:
+            self.buffer_pool.invalidate(self.data_file)
+        self._row_count = 0
+        self._deleted_count = None
         if os.path.exists(self.data_file):
             os.remove(self.data_file)
 
-    def delete_rows_by_condition(self, column_name, value):
-        if not os.path.exists(self.data_file):
+    def find_row_ids(self, col_index, value):
+        if not self.vectorized:
+            return [row_id for row_id, row in self.iter_rows(with_ids=True) if row[col_index] == value]
+
+        mm = self._get_mapping()
+        if mm is None:
+            return []
+
+        col = self.schema.columns[col_index]
+        # при чтении 0 и пустая строка превращаются в None, поэтому с ними ничего не совпадает
+        if col.data_type == DataType.INT:
+            if value is None:
+                target = 0
+            elif isinstance(value, int) and 0 < value < 2 ** 64:
+                target = value
+            else:
+                return []
+        else:
+            if value is None:
+                target = b''
+            else:
+                target = str(value).encode('utf-8')
+                if not target or len(target) > col.size:
+                    return []
+
+        records = np.frombuffer(mm, dtype=self.schema.numpy_dtype(), count=len(mm) // self.schema.row_size)
+        mask = (records[col.name] == target) & (records['#flag'] == ROW_LIVE)
+        # массив records ссылается на mmap и должен освободиться до его закрытия
+        del records
+
+        return np.flatnonzero(mask).tolist()
+
+    def delete_rows(self, row_ids):
+        mm = self._get_mapping()
+        if mm is None:
             return 0
 
+        row_size = self.schema.row_size
+        row_count = len(mm) // row_size
+        deleted_count = 0
+
+        with open(self.data_file, 'r+b') as f:
+            for row_id in sorted(set(row_ids)):
+                if row_id < 0 or row_id >= row_count:
+                    continue
+
+                offset = row_id * row_size
+                if mm[offset] != ROW_LIVE:
+                    continue
+
+                f.seek(offset)
+                f.write(bytes([ROW_DELETED]))
+                deleted_count += 1
+
+                if self.buffer_pool is not None:
+                    self.buffer_pool.invalidate(self.data_file, row_id // self.schema.rows_per_page)
+
+        if self._deleted_count is not None:
+            self._deleted_count += deleted_count
+
+        return deleted_count
+
+    def delete_rows_by_condition(self, column_name, value):
         col_index = None
         for i, col in enumerate(self.schema.columns):
             if col.name == column_name:
@@ -170,14 +499,160 @@ class BinaryStorage:
         if col_index is None:
             return 0
 
-        all_rows = self.get_all_rows()
-        self.delete_all_rows()
+        return self.delete_rows(self.find_row_ids(col_index, value))
 
-        deleted_count = 0
-        for row in all_rows:
-            if len(row) > col_index and row[col_index] == value:
-                deleted_count += 1
+    def vacuum(self):
+        mm = self._get_mapping()
+        if mm is None or self.get_deleted_count() == 0:
+            return 0
+
+        row_size = self.schema.row_size
+        end = (len(mm) // row_size) * row_size
+        removed_count = self.get_deleted_count()
+        tmp_file = self.data_file + '.vacuum'
+
+        with open(tmp_file, 'wb') as f:
+            for offset in range(0, end, DEFAULT_CHUNK_ROWS * row_size):
+                chunk = mm[offset:min(offset + DEFAULT_CHUNK_ROWS * row_size, end)]
+                f.write(b''.join(chunk[i:i + row_size] for i in range(0, len(chunk), row_size)
+                                 if chunk[i] == ROW_LIVE))
+
+        self._close_write_handle()
+        self._close_mapping()
+        self._replace_data_file(tmp_file)
+        if self.buffer_pool is not None:
+            self.buffer_pool.invalidate(self.data_file)
+        self._row_count = None
+        self._deleted_count = None
+
+        return removed_count
+
+    def upgrade_legacy_rows(self):
+        # файл без байта флага удаления переписывается: перед каждой строкой ставится ROW_LIVE
+        old_row_size = self.schema.stored_row_size
+        self._close_write_handle()
+        self._close_mapping()
+
+        if os.path.exists(self.data_file):
+            tmp_file = self.data_file + '.upgrade'
+            flag = bytes([ROW_LIVE])
+            chunk_bytes = DEFAULT_CHUNK_ROWS * old_row_size
+            with open(self.data_file, 'rb') as src, open(tmp_file, 'wb') as dst:
+                while True:
+                    chunk = src.read(chunk_bytes)
+                    if not chunk:
+                        break
+                    end = len(chunk) - len(chunk) % old_row_size
+                    dst.write(b''.join(flag + chunk[i:i + old_row_size] for i in range(0, end, old_row_size)))
+            self._replace_data_file(tmp_file)
+
+        if self.buffer_pool is not None:
+            self.buffer_pool.invalidate(self.data_file)
+        self._row_count = None
+        self._deleted_count = None
+        self.schema.stored_row_size = self.schema.row_size
+
+class ColumnarStorage:
+    def __init__(self, data_path, schema, sync_policy=None, vectorized=True, buffer_pool=None):
+        self.data_file = data_path
+        self.schema = schema
+        self.column_storages = []
+
+        for col in schema.columns:
+            column_schema = TableSchema(f"{schema.table_name}.{col.name}", [col])
+            column_file = f"{data_path}.{col.name}.col"
+            self.column_storages.append(
+                BinaryStorage(column_file, column_schema, sync_policy, vectorized, buffer_pool))
+
+        self.vectorized = all(storage.vectorized for storage in self.column_storages)
+
+    def end_statement(self):
+        for storage in self.column_storages:
+            storage.end_statement()
+
+    def flush(self):
+        for storage in self.column_storages:
+            storage.flush()
+
+    def close(self):
+        for storage in self.column_storages:
+            storage.close()
+
+    def insert_row(self, values):
+        self.insert_rows([values])
+
+    def insert_rows(self, rows):
+        rows = list(rows)
+        first_row_index = self.get_row_count()
+
+        for i, storage in enumerate(self.column_storages):
+            storage.insert_rows([[values[i] if i < len(values) else None] for values in rows])
+
+        return first_row_index
+
+    def get_row_count(self):
+        return self.column_storages[0].get_row_count()
+
+    def get_deleted_count(self):
+        return self.column_storages[0].get_deleted_count()
+
+    def get_live_row_count(self):
+        return self.column_storages[0].get_live_row_count()
+
+    def get_row(self, row_index, columns=None):
+        if columns is None:
+            columns = range(len(self.column_storages))
+
+        row = []
+        for i in columns:
+            value = self.column_storages[i].get_row(row_index)
+            if value is None:
+                return None
+            row.append(value[0])
+
+        return row
+
+    def get_all_rows(self):
+        return list(self.iter_rows())
+
+    def iter_rows(self, start=0, stop=None, chunk_rows=DEFAULT_CHUNK_ROWS, with_ids=False, columns=None):
+        if columns is None:
+            columns = range(len(self.column_storages))
+        columns = list(columns)
+
+        # флаги удаления продублированы в каждом файле столбца, поэтому итераторы идут синхронно
+        scanned = columns or [0]
+        iterators = [self.column_storages[i].iter_rows(start, stop, chunk_rows, with_ids=True) for i in scanned]
+
+        for parts in zip(*iterators):
+            row = [part[1][0] for part in parts] if columns else []
+            if with_ids:
+                yield parts[0][0], row
             else:
-                self.insert_row(row)
+                yield row
+
+    def find_row_ids(self, col_index, value):
+        return self.column_storages[col_index].find_row_ids(0, value)
 
+    def delete_all_rows(self):
+        for storage in self.column_storages:
+            storage.delete_all_rows()
+
+    def delete_rows(self, row_ids):
+        row_ids = list(row_ids)
+        deleted_count = 0
+        for storage in self.column_storages:
+            deleted_count = storage.delete_rows(row_ids)
         return deleted_count
+
+    def delete_rows_by_condition(self, column_name, value):
+        for i, col in enumerate(self.schema.columns):
+            if col.name == column_name:
+                return self.delete_rows(self.find_row_ids(i, value))
+        return 0
+
+    def vacuum(self):
+        removed_count = 0
+        for storage in self.column_storages:
+            removed_count = storage.vacuum()
+        return removed_count
@@ -0,0 +1,216 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+ENGINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '7ex')
+sys.path.insert(0, ENGINE_DIR)
+
+from database import SimpleDB, INDEX_TYPES
+from index import BaseIndex, SnapshotIndex
+
+def test_hash_index_keys_use_truncated_varchar(tmp_path):
+    db = SimpleDB(str(tmp_path))
+    db.execute_sql("CREATE TABLE h (id INT, name VARCHAR(3))")
+    db.execute_sql("CREATE INDEX ON h (name)")
+    db.execute_sql("INSERT INTO h VALUES (1, 'abcdef')")
+    db.prepare("INSERT INTO h VALUES (?, ?)").execute((2, 'abcXYZ'))
+    db.insert_many('h', [[3, 'aéz']])
+
+    assert sorted(db.execute_sql("SELECT * FROM h WHERE name = 'abc'")) == [[1, 'abc'], [2, 'abc']]
+    assert db.execute_sql("SELECT * FROM h WHERE name = 'abcdef'") == []
+    # 'é' занимает два байта, поэтому в три байта помещается только 'aé'
+    assert db.execute_sql("SELECT id FROM h WHERE name = 'aé'") == [[3]]
+
+    index = db.indexes['h_name']
+    live_keys = dict(index.index_data)
+    index.rebuild_index(db.tables['h'])
+    assert index.index_data == live_keys
+    db.close()
+
+def test_unique_check_compares_truncated_varchar(tmp_path):
+    db = SimpleDB(str(tmp_path))
+    db.execute_sql("CREATE TABLE u (id INT PRIMARY KEY, name VARCHAR(3) UNIQUE)")
+    db.execute_sql("INSERT INTO u VALUES (1, 'abcX')")
+    for sql in ("INSERT INTO u VALUES (2, 'abcY')", "INSERT INTO u VALUES (3, 'xyz1'), (4, 'xyz2')"):
+        try:
+            db.execute_sql(sql)
+        except Exception as ex:
+            assert 'уникальности' in str(ex)
+        else:
+            raise AssertionError(sql)
+
+    assert db.execute_sql("SELECT * FROM u") == [[1, 'abc']]
+    assert db.execute_sql("SELECT id FROM u WHERE name = 'abc'") == [[1]]
+    db.close()
+
+def test_covered_read_of_long_varchar_survives_restart(tmp_path):
+    with SimpleDB(str(tmp_path)) as db:
+        db.execute_sql("CREATE TABLE cv (id INT, g INT, name VARCHAR(4))")
+        db.execute_sql("CREATE INDEX ON cv (g) INCLUDE (name)")
+        db.execute_sql("INSERT INTO cv VALUES (1, 7, 'abcdefgh'), (2, 7, 'xy')")
+        before = sorted(db.execute_sql("SELECT name FROM cv WHERE g = 7"))
+        assert before == [['abcd'], ['xy']]
+
+    with SimpleDB(str(tmp_path)) as db:
+        assert sorted(db.execute_sql("SELECT name FROM cv WHERE g = 7")) == before
+
+def test_index_classes_implement_the_base_interface(tmp_path):
+    for base in (BaseIndex, SnapshotIndex):
+        with pytest.raises(TypeError):
+            base(str(tmp_path / 'x.index'), 'x')
+
+    for name, index_class in INDEX_TYPES.items():
+        index = index_class.lazy(str(tmp_path / f'{name}.index'), ['x'] if index_class.MULTI_COLUMN else 'x')
+        assert not index.loaded
+    # B+-дерево пишет файл постранично, а не снимком
+    assert not issubclass(INDEX_TYPES['btree'], SnapshotIndex)
+
+@pytest.mark.parametrize('using, column', [('', 'g'), ('USING COMPACT', 'g'), ('USING BTREE', 'g'), ('USING BITMAP', 'g'),
+                                           ('', 'name'), ('USING PREFIX', 'name'), ('USING FULLTEXT', 'name')])
+def test_delete_updates_index_like_a_rebuild(tmp_path, using, column):
+    db = SimpleDB(str(tmp_path), vacuum_threshold=0.9)
+    db.execute_sql("CREATE TABLE d (id INT, g INT, name VARCHAR(8))")
+    db.insert_many('d', [[i, i % 7 + 1, f'w{i % 5}'] for i in range(1, 5001)])
+    db.execute_sql(f"CREATE INDEX ON d ({column}) {using}")
+
+    # все строки одного ключа удаляются одним вызовом remove_entries
+    db.execute_sql("DELETE FROM d WHERE g = 3")
+    db.execute_sql("DELETE FROM d WHERE id BETWEEN 10 AND 900")
+    db.execute_sql("DELETE FROM d WHERE name = 'w1'")
+
+    index = db.indexes[f'd_{column}']
+    rebuilt = type(index)(index.index_file + '.check', column)
+    rebuilt.rebuild_index(db.tables['d'])
+    keys = range(1, 8) if column == 'g' else [f'w{i}' for i in range(5)]
+    for key in keys:
+        assert sorted(index.find_rows(key)) == sorted(rebuilt.find_rows(key)), key
+    assert not list(index.find_rows(3 if column == 'g' else 'w1'))
+    db.close()
+
+# --- индексы против полного просмотра ---
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'omega']
+
+def make_rows(start, stop):
+    rows = []
+    for i in range(start, stop):
+        body = ' '.join(WORDS[(i * k) % len(WORDS)] for k in (1, 2, 3)[:1 + i % 3])
+        rows.append([i, i % 13 + 1, f'nm{i % 11}', body])
+    return rows
+
+INDEX_CASES = [
+    ('number', "CREATE INDEX ON t (num)", ["num = 5", "num IN (1, 7)"]),
+    ('btree', "CREATE INDEX ON t (num) USING BTREE", ["num BETWEEN 3 AND 6", "num > 10", "num = 2"]),
+    ('hash', "CREATE INDEX ON t (name)", ["name = 'nm3'", "name IN ('nm1', 'nm9')"]),
+    ('compact', "CREATE INDEX ON t (num) USING COMPACT", ["num = 4", "num = 13"]),
+    ('composite', "CREATE INDEX ON t (num, name) INCLUDE (id)", ["num = 3 AND name = 'nm5'", "num = 3", "name = 'nm5'"]),
+    ('prefix', "CREATE INDEX ON t (name) USING PREFIX", ["name LIKE 'nm1%'", "name = 'nm7'"]),
+    ('fulltext', "CREATE INDEX ON t (body) USING FULLTEXT", ["body MATCH 'alpha & beta'", "body MATCH 'omega'"]),
+    ('bitmap', "CREATE INDEX ON t (num) USING BITMAP", ["num = 2", "num = 2 AND name = 'nm4'"]),
+]
+
+@pytest.mark.parametrize('index_type, create_sql, queries', INDEX_CASES, ids=[case[0] for case in INDEX_CASES])
+def test_index_matches_full_scan(tmp_path, index_type, create_sql, queries):
+    # таблица t с индексом сравнивается с такой же таблицей s без индексов
+    def check(db):
+        for where in queries:
+            indexed = sorted(db.execute_sql(f"SELECT id, num, name FROM t WHERE {where}"))
+            scanned = sorted(db.execute_sql(f"SELECT id, num, name FROM s WHERE {where}"))
+            assert indexed == scanned, where
+
+    def apply(db, sql):
+        for table in ('t', 's'):
+            db.execute_sql(sql.replace('{table}', table))
+
+    db = SimpleDB(str(tmp_path), vacuum_threshold=0.9)
+    apply(db, "CREATE TABLE {table} (id INT, num INT, name VARCHAR(16), body VARCHAR(40))")
+    rows = make_rows(1, 2000)
+    db.insert_many('t', rows)
+    db.insert_many('s', rows)
+    db.execute_sql(create_sql)
+    assert db.catalog['indexes'][next(iter(db.catalog['indexes']))]['type'] == index_type
+    check(db)
+
+    apply(db, "DELETE FROM {table} WHERE id BETWEEN 100 AND 400")
+    apply(db, "DELETE FROM {table} WHERE num = 3 AND name = 'nm5'")
+    check(db)
+
+    rows = make_rows(2000, 2300)
+    db.insert_many('t', rows)
+    db.insert_many('s', rows)
+    apply(db, "INSERT INTO {table} VALUES (5000, 3, 'nm5', 'alpha beta')")
+    check(db)
+
+    apply(db, "VACUUM {table}")
+    check(db)
+    db.close()
+
+    db = SimpleDB(str(tmp_path), vacuum_threshold=0.9)
+    check(db)
+    apply(db, "DELETE FROM {table} WHERE num = 4")
+    apply(db, "INSERT INTO {table} VALUES (5001, 4, 'nm1', 'omega')")
+    check(db)
+    db.close()
+
+    with SimpleDB(str(tmp_path)) as db:
+        check(db)
+
+# --- восстановление после сбоев ---
+
+def run_crashed(db_dir, code):
+    # отдельный процесс выполняет запросы и завершается без close(), как при сбое
+    script = textwrap.dedent(f"""
+        import os, sys
+        sys.path.insert(0, {ENGINE_DIR!r})
+        from database import SimpleDB
+        db = SimpleDB({db_dir!r})
+    """) + textwrap.dedent(code) + "\nos._exit(0)\n"
+    subprocess.run([sys.executable, '-c', script], check=True)
+
+def test_composite_index_after_delete_all_on_reopened_table(tmp_path):
+    with SimpleDB(str(tmp_path)) as db:
+        db.execute_sql("CREATE TABLE c (id INT, a INT, b INT)")
+        db.insert_many('c', [[i, i % 5 + 1, i % 3 + 1] for i in range(1, 500)])
+        db.execute_sql("CREATE INDEX ON c (a, b)")
+
+    # индекс после открытия еще не загружен, DELETE * должен очистить его целиком
+    with SimpleDB(str(tmp_path)) as db:
+        db.execute_sql("DELETE * FROM c")
+        db.execute_sql("INSERT INTO c VALUES (1000, 2, 3), (1001, 2, 1)")
+        assert db.execute_sql("SELECT id FROM c WHERE a = 2 AND b = 3") == [[1000]]
+        assert sorted(db.execute_sql("SELECT id FROM c WHERE a = 2")) == [[1000], [1001]]
+
+    with SimpleDB(str(tmp_path)) as db:
+        assert db.execute_sql("SELECT id FROM c WHERE a = 2 AND b = 3") == [[1000]]
+        assert sorted(db.execute_sql("SELECT id FROM c WHERE a = 2")) == [[1000], [1001]]
+
+    run_crashed(str(tmp_path), """
+        db.execute_sql("DELETE * FROM c")
+        db.execute_sql("INSERT INTO c VALUES (2000, 2, 3)")
+    """)
+
+    with SimpleDB(str(tmp_path)) as db:
+        assert db.execute_sql("SELECT id FROM c WHERE a = 2 AND b = 3") == [[2000]]
+        assert db.execute_sql("SELECT id FROM c WHERE a = 2") == [[2000]]
+
+def test_covered_read_after_unclean_exit(tmp_path):
+    with SimpleDB(str(tmp_path)) as db:
+        db.execute_sql("CREATE TABLE cv (id INT, g INT, name VARCHAR(12))")
+        db.insert_many('cv', [[i, i % 9 + 1, f'u{i}'] for i in range(1, 1000)])
+        db.execute_sql("CREATE INDEX ON cv (id)")
+        db.execute_sql("CREATE INDEX ON cv (g) INCLUDE (name)")
+        assert db.execute_sql("SELECT id FROM cv WHERE id = 5") == [[5]]
+
+    run_crashed(str(tmp_path), """
+        db.execute_sql("SELECT name FROM cv WHERE g = 6")
+        db.execute_sql("DELETE FROM cv WHERE id = 5")
+    """)
+
+    with SimpleDB(str(tmp_path)) as db:
+        assert db.execute_sql("SELECT id FROM cv WHERE id = 5") == []
+        names = [row[0] for row in db.execute_sql("SELECT name FROM cv WHERE g = 6")]
+        assert 'u5' not in names
+        assert sorted(names) == sorted(f'u{i}' for i in range(1, 1000) if i % 9 + 1 == 6 and i != 5)
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '7ex'))
+
+from database import SimpleDB
+from sql_parser import parse_sql, And, Or, Not, Insert
+
+def test_insert_keeps_quoted_commas_and_escaped_quotes():
+    statement = parse_sql("INSERT INTO t VALUES (1, 'Smith, John', 'it''s'), (2, \"a,b\", 'x')")
+    assert isinstance(statement, Insert)
+    assert statement.rows == [[1, 'Smith, John', "it's"], [2, 'a,b', 'x']]
+
+def test_cached_templates_do_not_leak_literals():
+    first = parse_sql("SELECT id FROM t WHERE name = 'a, b' AND id = 1")
+    second = parse_sql("SELECT id FROM t WHERE name = 'c''d' AND id = 2")
+    assert [item.values for item in first.where.items] == [['a, b'], [1]]
+    assert [item.values for item in second.where.items] == [["c'd"], [2]]
+
+def test_not_binds_tighter_than_and_and_and_tighter_than_or():
+    where = parse_sql("SELECT id FROM t WHERE NOT a = 1 AND b IN (1, 2) OR c BETWEEN 3 AND 5").where
+    assert isinstance(where, Or) and len(where.items) == 2
+
+    left, right = where.items
+    assert isinstance(left, And)
+    assert isinstance(left.items[0], Not) and left.items[0].item.column == 'a'
+    assert (left.items[1].column, left.items[1].op, left.items[1].values) == ('b', 'IN', [1, 2])
+    assert (right.column, right.op, right.values) == ('c', 'BETWEEN', [3, 5])
+
+def test_between_and_is_not_split_by_outer_and():
+    where = parse_sql("SELECT id FROM t WHERE a BETWEEN 1 AND 5 AND b NOT IN (3, 4)").where
+    assert isinstance(where, And) and len(where.items) == 2
+    assert where.items[0].values == [1, 5]
+    assert isinstance(where.items[1], Not) and where.items[1].item.op == 'IN'
+
+def test_literals_round_trip_through_table(tmp_path):
+    with SimpleDB(str(tmp_path)) as db:
+        db.execute_sql("CREATE TABLE p (id INT, name VARCHAR(30), note VARCHAR(30))")
+        db.execute_sql("INSERT INTO p VALUES (1, 'Smith, John', 'it''s'), (2, 'a,b', 'x')")
+        assert db.execute_sql("SELECT name, note FROM p WHERE id = 1") == [['Smith, John', "it's"]]
+        assert db.execute_sql("SELECT id FROM p WHERE note = 'it''s' AND NOT name = 'a,b'") == [[1]]
+
+    with SimpleDB(str(tmp_path)) as db:
+        assert db.execute_sql("SELECT name FROM p WHERE id IN (2)") == [['a,b']]
+
+def test_limit_is_validated_after_binding():
+    assert parse_sql("SELECT id FROM t LIMIT 5").limit == 5
+    with pytest.raises(Exception):
+        parse_sql("SELECT id FROM t LIMIT -1")
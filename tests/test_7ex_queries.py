@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '7ex'))
+
+from database import SimpleDB
+
+def make_table(db, count=300):
+    db.execute_sql("CREATE TABLE t (id INT, name VARCHAR(12), g INT)")
+    db.insert_many('t', [[i, f'n{i}', i % 7 + 1] for i in range(1, count + 1)])
+
+def test_prepared_select_reuses_its_plan(tmp_path):
+    with SimpleDB(str(tmp_path)) as db:
+        make_table(db)
+        db.execute_sql("CREATE INDEX ON t (id)")
+
+        select = db.prepare("SELECT name FROM t WHERE id = ? AND g = ?")
+        assert select.execute((8, 2)) == [['n8']]
+        plan = select.plan
+        assert select.execute((9, 3)) == [['n9']]
+        assert select.execute((9, 4)) == []
+        assert select.plan is plan
+        assert list(select.execute_iter((10, 4))) == [['n10']]
+
+        page = db.prepare("SELECT id FROM t WHERE g = ? LIMIT ? OFFSET ?")
+        assert page.execute((1, 2, 1)) == [[14], [21]]
+
+def test_prepared_plan_follows_new_indexes_and_tables(tmp_path):
+    with SimpleDB(str(tmp_path)) as db:
+        make_table(db)
+        select = db.prepare("SELECT id FROM t WHERE name = ?")
+        assert select.execute(('n5',)) == [[5]]
+        plan = select.plan
+
+        db.execute_sql("CREATE INDEX ON t (name)")
+        assert select.execute(('n6',)) == [[6]]
+        assert select.plan is not plan
+        assert select.plan.candidates[('name',)] is db.indexes['t_name']
+
+        make_table(db, 3)
+        assert select.execute(('n2',)) == db.execute_sql("SELECT id FROM t WHERE name = 'n2'")
+        assert select.plan.storage is db.tables['t']
+
+def test_prepared_delete_binds_each_call(tmp_path):
+    with SimpleDB(str(tmp_path)) as db:
+        make_table(db)
+        db.execute_sql("CREATE INDEX ON t (g)")
+        delete = db.prepare("DELETE FROM t WHERE g = ? AND id > ?")
+        delete.executemany([(1, 100), (2, 0)])
+
+        assert db.execute_sql("SELECT id FROM t WHERE g = 2") == []
+        assert sorted(db.execute_sql("SELECT id FROM t WHERE g = 1")) == [[i] for i in range(7, 101, 7)]
+        assert db.execute_sql("SELECT id FROM t WHERE g = 3") == [[i] for i in range(2, 301, 7)]
+
+def test_offset_without_deleted_rows_seeks_to_the_first_row(tmp_path, monkeypatch):
+    with SimpleDB(str(tmp_path)) as db:
+        make_table(db)
+        storage = db.tables['t']
+        starts = []
+        real_iter_rows = storage.iter_rows
+
+        def iter_rows(start=0, stop=None, **kwargs):
+            starts.append((start, stop))
+            return real_iter_rows(start, stop, **kwargs)
+
+        monkeypatch.setattr(storage, 'iter_rows', iter_rows)
+        assert db.execute_sql("SELECT id FROM t LIMIT 3 OFFSET 250") == [[251], [252], [253]]
+        assert starts == [(250, 253)]
+        assert db.execute_sql("SELECT id FROM t LIMIT 10 OFFSET 298") == [[299], [300]]
+        assert db.execute_sql("SELECT id FROM t LIMIT 5 OFFSET 300") == []
+
+        # после DELETE смещение считается по живым строкам
+        db.execute_sql("DELETE FROM t WHERE id < 11")
+        starts.clear()
+        assert db.execute_sql("SELECT id FROM t LIMIT 2 OFFSET 5") == [[16], [17]]
+        assert starts == [(0, None)]
+
+        with pytest.raises(Exception, match="неотрицательными"):
+            db.prepare("SELECT id FROM t LIMIT 2 OFFSET ?").execute((-1,))
@@ -0,0 +1,201 @@
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '7ex'))
+
+import storage
+from buffer_pool import BufferPool, PAGE_SIZE
+from database import SimpleDB
+from storage import SyncPolicy
+
+def record_file_ops(monkeypatch):
+    # fsync обычных файлов и папок различается по типу дескриптора
+    ops = []
+    real_fsync, real_replace = os.fsync, os.replace
+
+    def fsync(fd):
+        ops.append('fsync dir' if stat.S_ISDIR(os.fstat(fd).st_mode) else 'fsync file')
+        real_fsync(fd)
+
+    def replace(src, dst):
+        ops.append('replace ' + os.path.basename(src))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(storage.os, 'fsync', fsync)
+    monkeypatch.setattr(storage.os, 'replace', replace)
+    return ops
+
+def test_vacuum_syncs_compacted_file_before_and_after_swap(tmp_path, monkeypatch):
+    db = SimpleDB(str(tmp_path), vacuum_threshold=0.9, sync_policy=SyncPolicy(SyncPolicy.STATEMENT))
+    db.execute_sql("CREATE TABLE v (id INT, name VARCHAR(8))")
+    db.insert_many('v', [[i, f'v{i}'] for i in range(1, 101)])
+    db.execute_sql("DELETE FROM v WHERE id < 51")
+
+    ops = record_file_ops(monkeypatch)
+    db.execute_sql("VACUUM v")
+    swap = ops.index('replace v.data.vacuum')
+    assert 'fsync file' in ops[:swap]
+    if hasattr(os, 'O_DIRECTORY'):
+        assert 'fsync dir' in ops[swap + 1:]
+
+    assert db.tables['v'].get_row_count() == 50
+    assert db.execute_sql("SELECT name FROM v WHERE id = 51") == [['v51']]
+    db.close()
+
+def test_vacuum_without_sync_policy_skips_fsync(tmp_path, monkeypatch):
+    db = SimpleDB(str(tmp_path), vacuum_threshold=0.9)
+    db.execute_sql("CREATE TABLE v (id INT)")
+    db.insert_many('v', [[i] for i in range(1, 11)])
+    db.execute_sql("DELETE FROM v WHERE id < 6")
+
+    ops = record_file_ops(monkeypatch)
+    db.execute_sql("VACUUM v")
+    assert ops == ['replace v.data.vacuum']
+    db.close()
+
+def count_fsyncs(monkeypatch):
+    calls = []
+    real_fsync = os.fsync
+
+    def fsync(fd):
+        calls.append(fd)
+        real_fsync(fd)
+
+    monkeypatch.setattr(storage.os, 'fsync', fsync)
+    return calls
+
+@pytest.mark.parametrize('policy, expected_fsyncs', [
+    (SyncPolicy(SyncPolicy.STATEMENT), 10),
+    (SyncPolicy(SyncPolicy.ROWS, rows=4), 2),
+    (SyncPolicy(SyncPolicy.INTERVAL, interval=3600), 0),
+    (SyncPolicy(SyncPolicy.NEVER), 0),
+])
+def test_sync_policy_controls_fsync(tmp_path, monkeypatch, policy, expected_fsyncs):
+    db = SimpleDB(str(tmp_path), sync_policy=policy)
+    db.execute_sql("CREATE TABLE w (id INT, name VARCHAR(10))")
+    row_size = db.tables['w'].schema.row_size
+
+    calls = count_fsyncs(monkeypatch)
+    for i in range(1, 11):
+        db.execute_sql(f"INSERT INTO w VALUES ({i}, 'w{i}')")
+        # при любой политике строка доходит до файла к концу запроса
+        assert os.path.getsize(tmp_path / 'w.data') == i * row_size
+    assert len(calls) == expected_fsyncs
+
+    db.close()
+    assert len(calls) == expected_fsyncs + (policy.mode != SyncPolicy.NEVER)
+
+    db = SimpleDB(str(tmp_path))
+    assert db.execute_sql("SELECT name FROM w WHERE id = 10") == [['w10']]
+    db.close()
+
+def test_unknown_sync_mode_is_rejected():
+    with pytest.raises(Exception, match="Неизвестный режим fsync"):
+        SyncPolicy('always')
+
+def test_columnar_table_keeps_one_file_per_column(tmp_path):
+    db = SimpleDB(str(tmp_path), vacuum_threshold=0.9)
+    db.execute_sql("CREATE TABLE c (id INT, name VARCHAR(8), score INT) STORAGE COLUMNAR")
+    db.insert_many('c', [[i, f'c{i}', i * 10] for i in range(1, 101)])
+    db.execute_sql("CREATE INDEX ON c (id)")
+
+    assert sorted(f for f in os.listdir(tmp_path) if f.startswith('c.') and f.endswith('.col')) == \
+        ['c.id.col', 'c.name.col', 'c.score.col']
+    assert not os.path.exists(tmp_path / 'c.data')
+    assert os.path.getsize(tmp_path / 'c.score.col') == 100 * db.tables['c'].column_storages[2].schema.row_size
+
+    assert db.execute_sql("SELECT name, score FROM c WHERE id = 42") == [['c42', 420]]
+    db.execute_sql("DELETE FROM c WHERE id < 51")
+    assert db.execute_sql("SELECT id FROM c WHERE id = 50") == []
+    db.execute_sql("VACUUM c")
+    assert db.tables['c'].get_row_count() == 50
+    db.close()
+
+    db = SimpleDB(str(tmp_path))
+    rows = db.execute_sql("SELECT * FROM c")
+    assert rows == [[i, f'c{i}', i * 10] for i in range(51, 101)]
+    assert db.execute_sql("SELECT score FROM c WHERE id = 77") == [[770]]
+    db.close()
+
+def test_buffer_pool_counts_hits_misses_and_evictions():
+    pool = BufferPool(memory_budget=2 * PAGE_SIZE)
+    loads = []
+
+    def loader(page_no):
+        loads.append(page_no)
+        return bytes(PAGE_SIZE)
+
+    for page_no in (0, 1, 0, 2, 0, 1):
+        pool.get_page('f', page_no, loader)
+
+    # страница 1 вытеснена страницей 2, а 0 оставалась самой свежей
+    assert loads == [0, 1, 2, 1]
+    stats = pool.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 4, 2)
+    assert stats['pages'] == 2 and stats['used_bytes'] == 2 * PAGE_SIZE
+
+def test_index_lookups_go_through_buffer_pool(tmp_path):
+    db = SimpleDB(str(tmp_path), buffer_pool_size=64 * 1024)
+    db.execute_sql("CREATE TABLE b (id INT, name VARCHAR(32))")
+    db.insert_many('b', [[i, f'b{i}'] for i in range(1, 5001)])
+    db.execute_sql("CREATE INDEX ON b (id)")
+
+    db.execute_sql("SELECT name FROM b WHERE id = 10")
+    before = db.buffer_pool.stats()
+    for _ in range(5):
+        assert db.execute_sql("SELECT name FROM b WHERE id = 10") == [['b10']]
+    stats = db.buffer_pool.stats()
+    assert stats['misses'] == before['misses']
+    assert stats['hits'] == before['hits'] + 5
+
+    for i in range(1, 5001, 50):
+        db.execute_sql(f"SELECT name FROM b WHERE id = {i}")
+    stats = db.buffer_pool.stats()
+    assert stats['evictions'] > 0
+    assert stats['used_bytes'] <= 64 * 1024
+    db.close()
+
+def write_legacy_table(path, row_size_delta=-1):
+    # таблица в формате до байта флага удаления: строки без первого байта слота
+    db = SimpleDB(str(path))
+    db.execute_sql("CREATE TABLE old (id INT, name VARCHAR(8))")
+    db.insert_many('old', [[i, f'o{i}'] for i in range(1, 6)])
+    row_size = db.tables['old'].schema.row_size
+    db.close()
+
+    data_file = path / 'old.data'
+    data = data_file.read_bytes()
+    data_file.write_bytes(b''.join(data[i + 1:i + row_size] for i in range(0, len(data), row_size)))
+
+    schema_file = path / 'old.schema'
+    schema = json.loads(schema_file.read_text())
+    schema['row_size'] = row_size + row_size_delta
+    schema_file.write_text(json.dumps(schema))
+    return row_size
+
+def test_legacy_rows_are_upgraded_on_load(tmp_path):
+    row_size = write_legacy_table(tmp_path)
+
+    db = SimpleDB(str(tmp_path))
+    assert db.execute_sql("SELECT * FROM old") == [[i, f'o{i}'] for i in range(1, 6)]
+    assert os.path.getsize(tmp_path / 'old.data') == 5 * row_size
+    assert json.loads((tmp_path / 'old.schema').read_text())['row_size'] == row_size
+
+    db.execute_sql("DELETE FROM old WHERE id = 3")
+    db.close()
+
+    db = SimpleDB(str(tmp_path))
+    assert db.execute_sql("SELECT id FROM old") == [[1], [2], [4], [5]]
+    db.close()
+
+def test_unknown_row_layout_is_rejected(tmp_path):
+    write_legacy_table(tmp_path, row_size_delta=3)
+
+    db = SimpleDB(str(tmp_path))
+    with pytest.raises(Exception, match="записан в неизвестном формате"):
+        db.execute_sql("SELECT * FROM old")
+    db.close()